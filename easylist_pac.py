@@ -19,39 +19,69 @@ __author__ = 'stsmith'
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import argparse as ap, copy, datetime, functools as fnt, numpy as np, os, re, sys, time, urllib.request, warnings
-
-try:
-    machine_learning_flag = True
-    import multiprocessing as mp, scipy.sparse as sps
-    from sklearn.linear_model import LogisticRegression
-    from sklearn.preprocessing import StandardScaler
-except ImportError as e:
-    machine_learning_flag = False
-    print(e)
-    warnings.warn("Install scikit-learn for more accurate EasyList rule selection.")
-
-try:
-    plot_flag = True
-    import matplotlib as mpl, matplotlib.pyplot as plt
-    # Legible plot style defaults
-    # http://matplotlib.org/api/matplotlib_configuration_api.html
-    # http://matplotlib.org/users/customizing.html
-    mpl.rcParams['figure.figsize'] = (10.0, 5.0)
-    mpl.rc('font', **{'family': 'sans-serif', 'weight': 'bold', 'size': 14})
-    mpl.rc('axes', **{'titlesize': 20, 'titleweight': 'bold', 'labelsize': 16, 'labelweight': 'bold'})
-    mpl.rc('legend', **{'fontsize': 14})
-    mpl.rc('figure', **{'titlesize': 16, 'titleweight': 'bold'})
-    mpl.rc('lines', **{'linewidth': 2.5, 'markersize': 18, 'markeredgewidth': 0})
-    mpl.rc('mathtext',
-           **{'fontset': 'custom', 'rm': 'sans:bold', 'bf': 'sans:bold', 'it': 'sans:italic', 'sf': 'sans:bold',
-              'default': 'it'})
-    # plt.rc('text',usetex=False) # [default] usetex should be False
-    mpl.rcParams['text.latex.preamble'] = [r'\\usepackage{amsmath,sfmath} \\boldmath']
-except ImportError as e:
-    plot_flag = False
-    print(e)
-    warnings.warn("Install matplotlib to plot rule priorities.")
+import argparse as ap, base64, collections, concurrent.futures as cf, copy, datetime, email.utils, functools as fnt, hashlib, \
+    inspect, io, itertools, multiprocessing as mp, numpy as np, os, re, sys, time, urllib.error, urllib.request, warnings
+
+# scikit-learn, scipy and matplotlib are slow to load; they are imported by the stages that use them
+machine_learning_flag = None
+sklearn_flag = None
+plot_flag = None
+
+def machine_learning_import():
+    """Import the logistic regression modules into the module namespace. Returns whether they are available.
+scipy is needed for either scorer; see sklearn_import for scikit-learn's."""
+    global machine_learning_flag, spo, sps, spsl, shared_memory
+    if machine_learning_flag is None:
+        try:
+            import scipy.optimize as spo, scipy.sparse as sps, scipy.sparse.linalg as spsl
+            from multiprocessing import shared_memory
+            machine_learning_flag = True
+        except ImportError as e:
+            machine_learning_flag = False
+            print(e)
+            warnings.warn("Install scipy and scikit-learn for more accurate EasyList rule selection.")
+    return machine_learning_flag
+
+def sklearn_import():
+    """Import scikit-learn's logistic regression and scaler. Returns whether they are available."""
+    global sklearn_flag, LogisticRegression, StandardScaler
+    if sklearn_flag is None:
+        try:
+            from sklearn.linear_model import LogisticRegression
+            from sklearn.preprocessing import StandardScaler
+            sklearn_flag = True
+        except ImportError as e:
+            sklearn_flag = False
+            print(e)
+            warnings.warn("Install scikit-learn for faster logistic regression; using the NumPy scorer.")
+    return sklearn_flag
+
+def plot_import():
+    """Import and style matplotlib. Returns whether it is available."""
+    global plot_flag, mpl, plt
+    if plot_flag is None:
+        try:
+            import matplotlib as mpl, matplotlib.pyplot as plt
+            plot_flag = True
+            # Legible plot style defaults
+            # http://matplotlib.org/api/matplotlib_configuration_api.html
+            # http://matplotlib.org/users/customizing.html
+            mpl.rcParams['figure.figsize'] = (10.0, 5.0)
+            mpl.rc('font', **{'family': 'sans-serif', 'weight': 'bold', 'size': 14})
+            mpl.rc('axes', **{'titlesize': 20, 'titleweight': 'bold', 'labelsize': 16, 'labelweight': 'bold'})
+            mpl.rc('legend', **{'fontsize': 14})
+            mpl.rc('figure', **{'titlesize': 16, 'titleweight': 'bold'})
+            mpl.rc('lines', **{'linewidth': 2.5, 'markersize': 18, 'markeredgewidth': 0})
+            mpl.rc('mathtext',
+                   **{'fontset': 'custom', 'rm': 'sans:bold', 'bf': 'sans:bold', 'it': 'sans:italic', 'sf': 'sans:bold',
+                      'default': 'it'})
+            # plt.rc('text',usetex=False) # [default] usetex should be False
+            mpl.rcParams['text.latex.preamble'] = [r'\\usepackage{amsmath,sfmath} \\boldmath']
+        except ImportError as e:
+            plot_flag = False
+            print(e)
+            warnings.warn("Install matplotlib to plot rule priorities.")
+    return plot_flag
 
 class EasyListPAC:
     '''Create a Proxy Auto Configuration file from EasyList rule sets.'''
@@ -62,11 +92,12 @@ class EasyListPAC:
         self.parse_and_filter_rule_files()
         self.prioritize_rules()
         if not self.my_extra_rules_off:
-            self.easylist_append_rules(my_extra_rules)
+            EasyListParser(self.exceptions_include_flag, self.debug, good_table=self.good_table, bad_table=self.bad_table,
+                           rule_counts=self.rule_counts).easylist_append_rules(my_extra_rules, 'my_extra_rules')
         if self.debug:
-            print("Good rules and strengths:\n" + '\n'.join('{: 5d}:\t{}\t\t[{:2.1f}]'.format(i,r,s) for (i,(r,s)) in enumerate(zip(self.good_rules,self.good_signal))))
-            print("\nBad rules and strengths:\n" + '\n'.join('{: 5d}:\t{}\t\t[{:2.1f}]'.format(i,r,s) for (i,(r,s)) in enumerate(zip(self.bad_rules,self.bad_signal))))
-            if plot_flag:
+            print("Good rules and strengths:\n" + '\n'.join('{: 5d}:\t{}\t\t[{:2.1f}]'.format(i,r,s) for (i,(r,s)) in enumerate(zip(self.good_table.rules,self.good_signal))))
+            print("\nBad rules and strengths:\n" + '\n'.join('{: 5d}:\t{}\t\t[{:2.1f}]'.format(i,r,s) for (i,(r,s)) in enumerate(zip(self.bad_table.rules,self.bad_signal))))
+            if plot_import():
                 # plt.plot(np.arange(len(self.good_signal)), self.good_signal, '.')
                 # plt.show()
                 plt.plot(np.arange(len(self.bad_signal)), self.bad_signal, '.')
@@ -82,28 +113,95 @@ class EasyListPAC:
         # best choice is the LAN IP address of the http://hostname/proxy.pac web server or a dedicated blackhole server, e.g. 192.168.0.2:8119
         parser = ap.ArgumentParser()
         parser.add_argument('-b', '--blackhole', help="Blackhole IP:port", type=str, default='127.0.0.1:8119')
+        parser.add_argument('-bf', '--bloom-filter', help="Also write the bad exact host and host/path tables as Bloom "
+                            "filters with this false positive rate, e.g. 0.01, tested before the tables (0 for none)",
+                            type=float, default=0.)
+        parser.add_argument('-bb', '--byte-budget', help="Budget selection: maximum bytes of rules (-1 for unlimited)",
+                            type=int, default=-1)
+        parser.add_argument('-cb', '--cost-budget', help="Budget selection: maximum rule evaluation cost, in regex alternatives "
+                            "tested per URL (-1 for unlimited)", type=float, default=-1.)
         parser.add_argument('-d', '--download-dir', help="Download directory", type=str, default='~/Downloads')
+        parser.add_argument('-dm', '--domain-anchor-matching', help="Test domain anchored host and host/path regex rules "
+                            "in buckets by the last two labels of each rule's host (host), or all in one regex (regex)",
+                            type=str, choices=['host', 'regex'], default='host')
+        parser.add_argument('-fr', '--full-refit', help="Recompute rule features and signals instead of reusing the last run's",
+                            action='store_true')
         parser.add_argument('-g', '--debug', help="Debug: Just print rules", action='store_true')
+        parser.add_argument('-he', '--hash-encoding', help="Write exact host tables as object literals (object), or as "
+                            "one sorted, delimited string each, split on first use and binary searched (packed); packed "
+                            "loads faster and is smaller for large -th tables, but each lookup is slower", type=str,
+                            choices=['object', 'packed'], default='object')
+        parser.add_argument('-j', '--jobs', help="Number of processes for rule parsing (-1 for all CPUs)", type=int,
+                            default=1)
         parser.add_argument('-moff', '--my_extra_rules_turnoff_flag', help="Turn off adding my extra rules", default=False, action='store_true')
+        parser.add_argument('-nc', '--no-cache', help="Don't use cached parsed rules", action='store_true')
+        parser.add_argument('-nml', '--no-ml', help="Prioritize rules with the bootstrap regex's only, without logistic regression",
+                            action='store_true')
         parser.add_argument('-p', '--proxy', help="Proxy host:port", type=str, default='')
         parser.add_argument('-P', '--PAC-original', help="Original proxy.pac file", type=str, default='proxy.pac.orig')
+        parser.add_argument('-ra', '--regex-assembly', help="Write regex rules as one prefix-factored regex (factored) "
+                            "or as a flat alternation (flat)", type=str, choices=['factored', 'flat'], default='factored')
         parser.add_argument('-rb', '--bad-rule-max', help="Maximum number of bad rules (-1 for unlimited)", type=int,
                             default=19999)
         parser.add_argument('-rg', '--good-rule-max', help="Maximum number of good rules (-1 for unlimited)",
                             type=int, default=1099)
+        parser.add_argument('-R', '--retries', help="Number of download retries with exponential backoff", type=int,
+                            default=3)
+        parser.add_argument('-sc', '--scorer', help="Logistic regression scorer: scikit-learn's liblinear if installed (auto), "
+                            "scikit-learn, the built-in NumPy scorer, or compare the two", type=str,
+                            choices=['auto', 'sklearn', 'numpy', 'compare'], default='auto')
+        parser.add_argument('-sm', '--selection-mode', help="Select the rules with the highest signals up to the rule maximums "
+                            "(count), or with the most total signal within the cost and byte budgets (budget)", type=str,
+                            choices=['count', 'budget'], default='count')
+        parser.add_argument('-T', '--timeout', help="Download timeout in seconds", type=float, default=30.)
         parser.add_argument('-th', '--truncate_hash', help="Truncate hash object length to maximum number", type=int,
                             default=3999)
         parser.add_argument('-tr', '--truncate_regex', help="Truncate regex rules to maximum number", type=int,
                             default=499)
-        parser.add_argument('-w', '--sliding-window', help="Sliding window training and test (slow)", action='store_true')
+        parser.add_argument('-u', '--EasyList_URLs', help="Replace the default EasyList URLs", type=str, nargs='+',
+                            default=None)
+        parser.add_argument('-um', '--url-parts-matching', help="Test url_parts rules in buckets by a keyword of each "
+                            "rule, as Adblock Plus does (keyword), or all in one regex (regex)", type=str,
+                            choices=['keyword', 'regex'], default='keyword')
+        parser.add_argument('-vr', '--verify-regex', help="File of URLs on which to check that factored and flat regex's "
+                            "match the same strings", type=str, default=None)
+        parser.add_argument('-w', '--sliding-window', help="Sliding window training and test", action='store_true')
+        parser.add_argument('-wm', '--sliding-window-method', help="Sliding window leave-one-out signals: approximate, "
+                            "exact refits (slow), or verify the approximation against exact refits", type=str,
+                            choices=['approx', 'exact', 'verify'], default='approx')
+        parser.add_argument('-wt', '--wildcard-translation', help="Translate EasyList wildcards to group-free tempered "
+                            "tokens (tempered), or to numbered lookahead backreferences limited by --wildcard-limit "
+                            "(backreference)", type=str, choices=['tempered', 'backreference'], default='tempered')
         parser.add_argument('-x', '--Extra_EasyList_URLs', help="Extra Easylsit URLs", type=str, nargs='+', default=[])
         parser.add_argument('-*', '--wildcard-limit', help="Limit the number of wildcards", type=int, default=999)
         parser.add_argument('-@@', '--exceptions_include_flag', help="Include exception rules", action='store_true')
         args = parser.parse_args()
         self.args = parser.parse_args()
+        # only the auto scorer falls back to NumPy without scikit-learn
+        if args.scorer in ('sklearn', 'compare') and not args.no_ml and not sklearn_import():
+            parser.error("--scorer {} needs scikit-learn".format(args.scorer))
+        if not 0 <= args.bloom_filter < 1:
+            parser.error("--bloom-filter must be a false positive rate in (0, 1), or 0 for none")
         self.blackhole_ip_port = args.blackhole
         self.easylist_dir = os.path.expanduser(args.download_dir)
+        self.cache_dir = os.path.join(self.easylist_dir, '.easylist_pac_cache')
+        self.cache_flag = not args.no_cache
+        self.full_refit = args.full_refit
+        self.machine_learning_flag = not args.no_ml
+        self.scorer = args.scorer
+        self.selection_mode = args.selection_mode
+        self.regex_assembly = args.regex_assembly
+        self.verify_regex_file = os.path.expanduser(args.verify_regex) if args.verify_regex else None
+        self.assembled_regexes = []
+        self.keyword_flag = args.url_parts_matching == 'keyword'
+        self.host_flag = args.domain_anchor_matching == 'host'
+        self.packed_flag = args.hash_encoding == 'packed'
+        self.bloom_false_positive_rate = args.bloom_filter
+        self.bucketed_regexes = []
+        self.cost_budget = args.cost_budget if args.cost_budget >= 0 else np.inf
+        self.byte_budget = args.byte_budget if args.byte_budget >= 0 else np.inf
         self.debug = args.debug
+        self.jobs = args.jobs if args.jobs >= 0 else os.cpu_count()
         self.my_extra_rules_off = args.my_extra_rules_turnoff_flag
         self.proxy_host_port = args.proxy
         self.orig_pac_file = os.path.join(self.easylist_dir, args.PAC_original)
@@ -113,9 +211,14 @@ class EasyListPAC:
         self.truncate_hash_max = args.truncate_hash if args.truncate_hash >= 0 else None
         self.truncate_alternatives_max = args.truncate_regex if args.truncate_regex >= 0 else None
         self.sliding_window = args.sliding_window
+        self.sliding_window_method = args.sliding_window_method
         self.exceptions_include_flag = args.exceptions_include_flag
         self.wildcard_named_group_limit = args.wildcard_limit if args.wildcard_limit >= 0 else None
+        self.tempered_flag = args.wildcard_translation == 'tempered'
+        self.easylist_urls = args.EasyList_URLs
         self.extra_easylist_urls = args.Extra_EasyList_URLs
+        self.download_timeout = args.timeout
+        self.download_retries = max(0, args.retries)
         return self.args
 
     def easylists_download_latest(self):
@@ -123,130 +226,122 @@ class EasyListPAC:
         easyprivacy_url = 'https://easylist.to/easylist/easyprivacy.txt'
         fanboy_annoyance_url = 'https://easylist.to/easylist/fanboy-annoyance.txt'
         fanboy_antifacebook = 'https://raw.githubusercontent.com/ryanbr/fanboy-adblock/master/fanboy-antifacebook.txt'
-        self.download_list = [fanboy_antifacebook, fanboy_annoyance_url, easyprivacy_url, easylist_url] + self.extra_easylist_urls
-        self.file_list = []
-        for url in self.download_list:
-            fname = os.path.basename(url)
-            fname_full = os.path.join(self.easylist_dir, fname)
-            file_utc = file_to_utc(fname_full) if os.path.isfile(os.path.join(self.easylist_dir, fname)) else 0.
-            resp = urllib.request.urlopen(urllib.request.Request(url, headers={'User-Agent': user_agent}))
-            url_utc = last_modified_to_utc(last_modified_resp(resp))
-            if (url_utc > file_utc) or (os.path.getsize(fname_full) == 0):  # download the newer file
-                with open(fname_full, mode='w', encoding='utf-8') as out_file:
-                    out_file.write(resp.read().decode('utf-8'))
-            self.file_list.append(fname_full)
+        default_list = [fanboy_antifacebook, fanboy_annoyance_url, easyprivacy_url, easylist_url] \
+            if self.easylist_urls is None else self.easylist_urls
+        self.download_list = default_list + self.extra_easylist_urls
+        self.file_list = [os.path.join(self.easylist_dir, os.path.basename(url)) for url in self.download_list]
+        # fetch all lists concurrently; unchanged lists come back as 304 Not Modified with no body
+        # downloads are left running so that parse_and_filter_rule_files can parse each list as soon as it arrives
+        executor = cf.ThreadPoolExecutor(max_workers=max(1, min(8, len(self.download_list))))
+        self.downloads = {executor.submit(easylist_download, url, fname_full, self.download_timeout, self.download_retries): fname_full
+                          for (url, fname_full) in zip(self.download_list, self.file_list)}
+        executor.shutdown(wait=False)
 
     def parse_and_filter_rule_files(self):
-        """Parse all rules into good and bad lists. Use flags to specify included/excluded rules."""
-        self.good_rules = []
-        self.bad_rules = []
-        self.good_opts = []
-        self.bad_opts = []
-        self.good_rules_include_flag = []
-        self.bad_rules_include_flag = []
-        for file in self.file_list:
-            with open(file, 'r', encoding='utf-8') as fd:
-                self.easylist_append_rules(fd)
-
-    def easylist_append_rules(self, fd):
-        """Append EasyList rules from file to good and bad lists."""
-        for line in fd:
-            line = line.rstrip()
-            try:
-                self.easylist_append_one_rule(line)
-            except self.RuleIgnored as e:
-                if self.debug: print(e,flush=True)
-                continue
-
-    class RuleIgnored(Exception):
-        pass
-
-    def easylist_append_one_rule(self, line):
-        """Append EasyList rules from line to good and bad lists."""
-        ignore_rules_flag = False
-        ignored_rules_count = 0
-        line_orig = line
-        # configuration lines and selector rules should already be filtered out
-        if re_test(configuration_re, line) or re_test(selector_re, line): raise self.RuleIgnored("Rule '{}' not added.".format(line))
-        exception_flag = exception_filter(line)  # block default; pass if True
-        line = exception_re.sub(r'\1', line)
-        option_exception_re = not3dimppuposgh_option_exception_re  # ignore these options by default
-        # delete all easylist options **prior** to regex and selector cases
-        # ignore domain limits for now
-        opts = ''  # default: no options in the rule
-        if re_test(option_re, line):
-            opts = option_re.sub(r'\2', line)
-            # domain-specific and other option exceptions: ignore
-            # too many rules (>~ 10k) bog down the browser; make reasonable exclusions here
-            line = option_re.sub(r'\1', line)  # delete all the options and continue
-        # ignore these cases
-        # comment case: ignore
-        if re_test(comment_re, line):
-            if re_test(commentname_sections_ignore_re, line):
-                ignored_rules_comment_start = comment_re.sub('', line)
-                if not ignore_rules_flag:
-                    ignored_rules_count = 0
-                    ignore_rules_flag = True
-                    print('Ignore rules following comment ', end='', flush=True)
-                print('"{}"… '.format(ignored_rules_comment_start), end='', flush=True)
+        """Parse all rules into good and bad lists. Use flags to specify included/excluded rules.
+
+Each list is parsed as soon as its download completes, overlapping download latency with parsing.
+The per-file results are concatenated in file_list order so that rule order is deterministic."""
+        # with --jobs, files are split into line chunks parsed across a process pool
+        # workers are spawned, not forked, as the download threads are still running
+        executor = cf.ProcessPoolExecutor(max_workers=self.jobs, mp_context=mp.get_context('spawn')) if self.jobs > 1 else None
+        parser_version = easylist_parser_version(self.exceptions_include_flag)
+        file_rules = {}
+        file_cache_keys = {}
+        for download in cf.as_completed(self.downloads):
+            file = self.downloads[download]
+            download.result()
+            source = os.path.basename(file)
+            with open(file, 'rb') as fd:
+                content = fd.read()
+            # unchanged lists load from the parsed-rule cache
+            file_cache_keys[file] = hashlib.sha256(content).hexdigest() + '-' + parser_version
+            cached_rules = self.load_parsed_rules(source, file_cache_keys[file])
+            if cached_rules is not None:
+                file_rules[file] = [cached_rules]
+                file_cache_keys[file] = None
+            elif executor is None:
+                parser = EasyListParser(self.exceptions_include_flag, self.debug)
+                parser.easylist_append_rules(io.TextIOWrapper(io.BytesIO(content), encoding='utf-8'), source)
+                file_rules[file] = [(parser.good_table, parser.bad_table, parser.rule_counts)]
             else:
-                if ignore_rules_flag: print('\n {:d} rules ignored.'.format(ignored_rules_count), flush=True)
-                ignored_rules_count = 0
-                ignore_rules_flag = False
-            raise self.RuleIgnored("Rule '{}' not added.".format(line))
-        if ignore_rules_flag:
-            ignored_rules_count += 1
-            self.append_rule(exception_flag, line, opts, False)
-            raise self.RuleIgnored("Rule '{}' not added.".format(line))
-        # blank url case: ignore
-        if re_test(httpempty_re, line): raise self.RuleIgnored("Rule '{}' not added.".format(line))
-        # blank line case: ignore
-        if not bool(line): raise self.RuleIgnored("Rule '{}' not added.".format(line))
-        # block default or pass exception
-        if exception_flag:
-            option_exception_re = not3dimppuposgh_option_exception_re  # ignore these options within exceptions
-            if not self.exceptions_include_flag:
-                self.append_rule(exception_flag, line, opts, False)
-                raise self.RuleIgnored("Rule '{}' not added.".format(line))
-        # specific options: ignore
-        if re_test(option_exception_re, opts):
-            self.append_rule(exception_flag, line, opts, False)
-            raise self.RuleIgnored("Rule '{}' not added.".format(line))
-        # add all remaining rules
-        self.append_rule(exception_flag, line, opts, True)
-
-    def append_rule(self,exception_flag,rule, opts, include_rule_flag):
-        if not bool(rule): return  # last chance to reject blank lines -- shouldn't happen
-        if exception_flag:
-            self.good_rules.append(rule)
-            self.good_opts.append(option_tokenizer(opts))
-            self.good_rules_include_flag.append(include_rule_flag)
-        else:
-            self.bad_rules.append(rule)
-            self.bad_opts.append(option_tokenizer(opts))
-            self.bad_rules_include_flag.append(include_rule_flag)
+                lines = io.TextIOWrapper(io.BytesIO(content), encoding='utf-8').readlines()
+                chunk_size = max(5000, -(-len(lines) // self.jobs))
+                file_rules[file] = [executor.submit(easylist_parse_chunk, chunk, source, self.exceptions_include_flag,
+                                                    self.debug, ignore_rules_flag)
+                                    for (chunk, ignore_rules_flag) in easylist_chunks(lines, chunk_size)]
+        # merge in file and chunk order
+        for file in self.file_list:
+            chunk_rules = [res if isinstance(res, tuple) else res.result() for res in file_rules[file]]
+            rule_counts = collections.Counter()
+            for (_, _, counts) in chunk_rules: rule_counts.update(counts)
+            file_rules[file] = (RuleTable.concatenate([good_table for (good_table, _, _) in chunk_rules]),
+                                RuleTable.concatenate([bad_table for (_, bad_table, _) in chunk_rules]), rule_counts)
+            if file_cache_keys[file] is not None: self.save_parsed_rules(os.path.basename(file), file_cache_keys[file], *file_rules[file])
+        if executor is not None: executor.shutdown()
+        self.good_table = RuleTable.concatenate([file_rules[file][0] for file in self.file_list])
+        self.bad_table = RuleTable.concatenate([file_rules[file][1] for file in self.file_list])
+        self.rule_counts = collections.Counter()
+        for file in self.file_list: self.rule_counts.update(file_rules[file][2])
+        self.print_rule_counts()
+
+    def parsed_rules_cache_file(self, source):
+        return os.path.join(self.cache_dir, source + '.npz')
+
+    def load_parsed_rules(self, source, cache_key):
+        """Load (good_table, bad_table, rule_counts) for a list from the cache, or None if it isn't current."""
+        if not self.cache_flag or not os.path.isfile(self.parsed_rules_cache_file(source)): return None
+        try:
+            with np.load(self.parsed_rules_cache_file(source)) as arrays:
+                if str(arrays['cache_key']) != cache_key: return None
+                rule_counts = collections.Counter({(source, reason): int(count) for (reason, count)
+                                                   in zip(EasyListParser.rule_reasons, arrays['rule_counts']) if count > 0})
+                return RuleTable.from_arrays(arrays, 'good_'), RuleTable.from_arrays(arrays, 'bad_'), rule_counts
+        except (OSError, KeyError, ValueError) as e:
+            warnings.warn("Ignoring parsed rule cache '{}': {}".format(self.parsed_rules_cache_file(source), e))
+            return None
+
+    def save_parsed_rules(self, source, cache_key, good_table, bad_table, rule_counts):
+        if not self.cache_flag: return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fname_tmp = self.parsed_rules_cache_file(source) + '.part.npz'
+        np.savez(fname_tmp, cache_key=np.array(cache_key),
+                 rule_counts=np.array([rule_counts[source, reason] for reason in EasyListParser.rule_reasons]),
+                 **good_table.to_arrays('good_'), **bad_table.to_arrays('bad_'))
+        os.replace(fname_tmp, self.parsed_rules_cache_file(source))
+
+    def print_rule_counts(self):
+        """Print the table of rule counts by source and reason."""
+        sources = list(collections.OrderedDict.fromkeys(source for (source, _) in self.rule_counts))
+        width = max([len('Rules by source')] + [len(source) for source in sources])
+        print('{:<{}}'.format('Rules by source', width) + ''.join(' {:>15}'.format(r) for r in EasyListParser.rule_reasons), flush=True)
+        for source in sources:
+            print('{:<{}}'.format(source, width) + ''.join(' {:15d}'.format(self.rule_counts[source, r]) for r in EasyListParser.rule_reasons), flush=True)
 
     def good_class_test(self,rule,opts=''):
-        return not bool(badregex_regex_filters_re.search(rule))
+        return not badregex_filter_test(rule)
 
     def bad_class_test(self,rule,opts=''):
         """Bad rule of interest if a match for the bad regex's or specific rule options,
 e.g. non-domain specific popups or images."""
-        return bool(badregex_regex_filters_re.search(rule)) \
+        return badregex_filter_test(rule) \
                 or (bool(opts) and bool(thrdp_im_pup_os_option_re.search(opts))
                     and not bool(not3dimppupos_option_exception_re.search(opts)))
 
     def prioritize_rules(self):
         # use bootstrap regex preferences
         # https://github.com/seatgeek/fuzzywuzzy would be great here if there were such a thing for regex
-        self.good_signal = np.array([self.good_class_test(x,opts) for (x,opts,f) in zip(self.good_rules,self.good_opts,self.good_rules_include_flag) if f], dtype=np.int)
-        self.bad_signal = np.array([self.bad_class_test(x,opts) for (x,opts,f) in zip(self.bad_rules,self.bad_opts,self.bad_rules_include_flag) if f], dtype=np.int)
-
-        self.good_columns = np.array([i for (i,f) in enumerate(self.good_rules_include_flag) if f],dtype=int)
-        self.bad_columns = np.array([i for (i,f) in enumerate(self.bad_rules_include_flag) if f],dtype=int)
+        self.good_columns = np.flatnonzero(self.good_table.include_flag)
+        self.bad_columns = np.flatnonzero(self.bad_table.include_flag)
 
         # Logistic Regression for more accurate rule priorities
-        if machine_learning_flag:
+        if not (self.machine_learning_flag and machine_learning_import()):
+            good_included = self.good_table[self.good_columns]
+            bad_included = self.bad_table[self.bad_columns]
+            self.good_signal = np.array([self.good_class_test(x,opts) for (x,opts) in zip(good_included.rules,good_included.opts)], dtype=int)
+            self.bad_signal = np.array([self.bad_class_test(x,opts) for (x,opts) in zip(bad_included.rules,bad_included.opts)], dtype=int)
+        else:
+            if self.scorer == 'auto': self.scorer = 'sklearn' if sklearn_import() else 'numpy'
             print("Performing logistic regression on rule sets. This will take a few minutes…",end='',flush=True)
             self.logreg_priorities()
             print(" done.", flush=True)
@@ -254,112 +349,244 @@ e.g. non-domain specific popups or images."""
             # truncate to positive signal strengths
             if not self.debug:
                 self.good_rule_max = min(self.good_rule_max,np.count_nonzero(self.good_signal > 0)) \
-                    if isinstance(self.good_rule_max,(int,np.int)) else np.count_nonzero(self.good_signal > 0)
+                    if isinstance(self.good_rule_max,int) else np.count_nonzero(self.good_signal > 0)
                 self.bad_rule_max = min(self.bad_rule_max, np.count_nonzero(self.bad_signal > 0)) \
-                    if isinstance(self.bad_rule_max,(int,np.int)) else np.count_nonzero(self.bad_signal > 0)
+                    if isinstance(self.bad_rule_max,int) else np.count_nonzero(self.bad_signal > 0)
 
         # prioritize and limit the rules
-        good_pridx = np.array([e[0] for e in sorted(enumerate(self.good_signal),key=lambda e: e[1],reverse=True)],dtype=int)[:self.good_rule_max]
+        # stable descending sort: equal signals keep their rule order
+        if self.selection_mode == 'budget':
+            good_pridx, bad_pridx = self.budget_selection()
+        else:
+            good_pridx = np.argsort(-self.good_signal,kind='stable')
+            bad_pridx = np.argsort(-self.bad_signal,kind='stable')
+        good_pridx = good_pridx[:self.good_rule_max]
         self.good_columns = self.good_columns[good_pridx]
         self.good_signal = self.good_signal[good_pridx]
-        self.good_rules = [self.good_rules[k] for k in self.good_columns]
-        bad_pridx = np.array([e[0] for e in sorted(enumerate(self.bad_signal),key=lambda e: e[1],reverse=True)],dtype=int)[:self.bad_rule_max]
+        self.good_table = self.good_table[self.good_columns]
+        bad_pridx = bad_pridx[:self.bad_rule_max]
         self.bad_columns = self.bad_columns[bad_pridx]
         self.bad_signal = self.bad_signal[bad_pridx]
-        self.bad_rules = [self.bad_rules[k] for k in self.bad_columns]
+        self.bad_table = self.bad_table[self.bad_columns]
 
         # include hardcoded rules
+        good_rules = OrderedRuleSet(self.good_table.rules)
         for rule in include_these_good_rules:
-            if rule not in self.good_rules: self.good_rules.append(rule)
+            if rule not in good_rules:
+                good_rules.append(rule)
+                self.good_table.append(rule, '', True, 'include_these_good_rules', *easylist_rule_category(rule)[1:])
+        bad_rules = OrderedRuleSet(self.bad_table.rules)
         for rule in include_these_bad_rules:
-            if rule not in self.bad_rules: self.bad_rules.append(rule)
+            if rule not in bad_rules:
+                bad_rules.append(rule)
+                self.bad_table.append(rule, '', True, 'include_these_bad_rules', *easylist_rule_category(rule)[1:])
 
         # rules are now ordered
-        self.good_columns = np.arange(0,len(self.good_rules),dtype=self.good_columns.dtype)
-        self.bad_columns = np.arange(0,len(self.bad_rules),dtype=self.bad_columns.dtype)
+        self.good_columns = np.arange(0,len(self.good_table),dtype=self.good_columns.dtype)
+        self.bad_columns = np.arange(0,len(self.bad_table),dtype=self.bad_columns.dtype)
 
         return
 
-    def logreg_priorities(self):
-        """Rule prioritization using logistic regression on bootstrap preferences."""
-        self.good_fv_json = {}
-        self.good_column_hash = {}
-        for col, (rule,opts) in enumerate(zip(self.good_rules,self.good_opts)):
-            feature_vector_append_column(rule, opts, col, self.good_fv_json)
-            self.good_column_hash[rule] = col
-        self.bad_fv_json = {}
-        self.bad_column_hash = {}
-        for col, (rule,opts) in enumerate(zip(self.bad_rules,self.bad_opts)):
-            feature_vector_append_column(rule, opts, col, self.bad_fv_json)
-            self.bad_column_hash[rule] = col
-
-        self.good_fv_mat, self.good_row_hash = fv_to_mat(self.good_fv_json, self.good_rules)
-        self.bad_fv_mat, self.bad_row_hash = fv_to_mat(self.bad_fv_json, self.bad_rules)
-
-        self.good_X_all = StandardScaler(with_mean=False).fit_transform(self.good_fv_mat.astype(np.float))
-        self.good_y_all = np.array([self.good_class_test(x,opts) for (x,opts) in zip(self.good_rules, self.good_opts)], dtype=np.int)
-
-        self.bad_X_all = StandardScaler(with_mean=False).fit_transform(self.bad_fv_mat.astype(np.float))
-        self.bad_y_all = np.array([self.bad_class_test(x,opts) for (x,opts) in zip(self.bad_rules, self.bad_opts)], dtype=np.int)
+    def budget_selection(self):
+        """Select the rules with the most total signal within the cost and byte budgets.
+
+Only rules with a positive signal that are written to a JS variable are candidates. Each rule's evaluation cost and
+size come from rule_cost. As in the usual greedy approximation to the knapsack problem, rules are taken in order of
+signal per priced use of the budgets, skipping any that no longer fit. Each budget is priced at the inverse of its
+size, then repriced by the fraction of it used, so a budget with room to spare stops crowding out rules; the
+selection with the most total signal is kept. Good and bad rules share the budgets.
+Returns the selected indices into good_signal and bad_signal, in descending signal order."""
+        candidates = []
+        for (name, exception_flag) in [('good', True), ('bad', False)]:
+            table = getattr(self, name + '_table')[getattr(self, name + '_columns')]
+            (rules, categories, patterns) = (table.rules, table.categories, table.patterns)
+            signal = getattr(self, name + '_signal')
+            for k in np.flatnonzero(signal > 0):
+                js_var = self.easylist_js_variable(rules[k], categories[k], patterns[k], exception_flag)
+                if js_var is not None:
+                    candidates.append((name, k, signal[k]) +
+                                      rule_cost(*js_var, self.tempered_flag, self.keyword_flag, self.host_flag, self.packed_flag))
+        signal = np.array([signal for (_, _, signal, _, _) in candidates])
+        usage = np.array([(cost, size) for (_, _, _, cost, size) in candidates]).reshape(-1, 2)
+        budgets = np.array([self.cost_budget, self.byte_budget])
+        prices = 1./budgets
+        best_signal = -np.inf
+        for _ in range(8):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                value = signal/(usage @ prices)
+            chosen = []
+            total = np.zeros(2)
+            for c in np.argsort(-value, kind='stable'):
+                if np.any(total + usage[c] > budgets): continue
+                total += usage[c]
+                chosen.append(c)
+            if signal[chosen].sum() > best_signal:
+                best_signal, best_chosen, (total_cost, total_size) = signal[chosen].sum(), chosen, total
+            fraction_used = total/budgets
+            if np.all(fraction_used[np.isfinite(budgets)] > 0.99): break
+            prices = prices*np.maximum(fraction_used, 1.e-3)
+        selected = {'good': [], 'bad': []}
+        for c in best_chosen: selected[candidates[c][0]].append(candidates[c][1])
+        print("Budget selection: {:d} good and {:d} bad rules, cost {:.0f}, {:.0f} bytes.".format(
+            len(selected['good']), len(selected['bad']), total_cost, total_size), flush=True)
+        return tuple(np.array(sorted(selected[name], key=lambda k: -getattr(self, name + '_signal')[k]), dtype=int)
+                     for name in ['good', 'bad'])
 
-        self.logit_fit_method_sample_weights()
+    def logreg_priorities(self):
+        """Rule prioritization using logistic regression on bootstrap preferences.
 
+Each rule's features, class label, sample weight and sliding window signal are saved with the model's vocabulary,
+and reused in the next run for rules with the same rule and options."""
         # inverse regularization signal; smaller values give more sparseness, less model rigidity
         self.C = 1.e1
 
+        for (name, exception_flag, class_test) in [('good', True, self.good_class_test), ('bad', False, self.bad_class_test)]:
+            table = getattr(self, name + '_table')
+            previous_rows, state = self.load_logreg_state(name, table)
+            old_rows = np.flatnonzero(previous_rows >= 0)
+            new_rows = np.flatnonzero(previous_rows < 0)
+            new_table = table[new_rows]
+
+            # features of new rules extend the saved vocabulary
+            vocabulary = {token: k for (k, token) in enumerate(state['vocabulary'])}
+            new_fv_mat, row_hash = rule_feature_matrix(new_table, vocabulary)
+            old_fv_mat = state['fv_mat'][previous_rows[old_rows]]
+            old_fv_mat = sps.csr_matrix((old_fv_mat.data, old_fv_mat.indices, old_fv_mat.indptr), shape=(len(old_rows), len(vocabulary)))
+            fv_mat = sps.vstack([old_fv_mat, new_fv_mat]).tocsr()[np.argsort(np.concatenate([old_rows, new_rows]), kind='stable')]
+            setattr(self, name + '_fv_mat', fv_mat)
+            setattr(self, name + '_row_hash', row_hash)
+            setattr(self, name + '_X_all', StandardScaler(with_mean=False).fit_transform(fv_mat.astype(float))
+                    if self.scorer != 'numpy' else standard_scale_columns(fv_mat))
+
+            y = np.zeros(len(table), dtype=int)
+            y[old_rows] = state['y'][previous_rows[old_rows]]
+            y[new_rows] = [class_test(x,opts) for (x,opts) in zip(new_table.rules, new_table.opts)]
+            setattr(self, name + '_y_all', y)
+            w = np.zeros(len(table))
+            w[old_rows] = state['w'][previous_rows[old_rows]]
+            w[new_rows] = self.logit_fit_method_sample_weights(new_table, exception_flag)
+            setattr(self, name + '_w_all', w)
+            # sliding window signals of unchanged rules, if computed by the same method
+            loo_signal = np.full(len(table), np.nan)
+            loo_signal[old_rows] = state['loo_signal'][previous_rows[old_rows]]
+            setattr(self, name + '_loo_signal_all', loo_signal)
+            setattr(self, name + '_loo_method', state['loo_method'])
+            setattr(self, name + '_signal', y[getattr(self, name + '_columns')])
+
         self.logreg_test_in_training()
         if self.sliding_window: self.logreg_sliding_window()
 
+        self.save_logreg_state('good')
+        self.save_logreg_state('bad')
         return
 
+    def logreg_state_file(self, name):
+        return os.path.join(self.cache_dir, 'logreg_{}.npz'.format(name))
+
+    def load_logreg_state(self, name, table):
+        """Load the saved logistic regression state for the good or bad rules.
+
+Returns each table row's index in the saved state (-1 for rules not in it) and the saved arrays.
+Without a current saved state, or with --full-refit, every row is new."""
+        previous_rows = np.full(len(table), -1)
+        state = {'vocabulary': [], 'fv_mat': sps.csr_matrix((0, 0)), 'y': np.zeros(0, dtype=int), 'w': np.zeros(0),
+                 'loo_signal': np.zeros(0), 'loo_method': ''}
+        if not self.cache_flag or self.full_refit or not os.path.isfile(self.logreg_state_file(name)): return previous_rows, state
+        try:
+            with np.load(self.logreg_state_file(name)) as arrays:
+                if str(arrays['version']) != logreg_state_version(self.C): return previous_rows, state
+                state_rows = {key: k for (k, key) in enumerate(zip(arrays_strings(arrays, 'rules'), arrays_strings(arrays, 'opts')))}
+                previous_rows[:] = [state_rows.get(key, -1) for key in zip(table.rules, table.opts)]
+                state = {'vocabulary': arrays_strings(arrays, 'vocabulary'),
+                         'fv_mat': sps.csr_matrix((arrays['fv_data'], arrays['fv_indices'], arrays['fv_indptr']),
+                                                  shape=tuple(arrays['fv_shape'])),
+                         'y': arrays['y'], 'w': arrays['w'], 'loo_signal': arrays['loo_signal'], 'loo_method': str(arrays['loo_method'])}
+        except (OSError, KeyError, ValueError) as e:
+            warnings.warn("Ignoring logistic regression state '{}': {}".format(self.logreg_state_file(name), e))
+            previous_rows[:] = -1
+        return previous_rows, state
+
+    def save_logreg_state(self, name):
+        if not self.cache_flag: return
+        table = getattr(self, name + '_table')
+        fv_mat = getattr(self, name + '_fv_mat')
+        # drop features no rule has any more
+        features = np.flatnonzero(fv_mat.getnnz(axis=0))
+        fv_mat = fv_mat[:, features].tocsr()
+        row_hash = getattr(self, name + '_row_hash')
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fname_tmp = self.logreg_state_file(name) + '.part.npz'
+        np.savez(fname_tmp, version=np.array(logreg_state_version(self.C)),
+                 fv_data=fv_mat.data, fv_indices=fv_mat.indices, fv_indptr=fv_mat.indptr, fv_shape=np.array(fv_mat.shape),
+                 y=getattr(self, name + '_y_all'), w=getattr(self, name + '_w_all'),
+                 loo_signal=getattr(self, name + '_loo_signal_all'), loo_method=np.array(getattr(self, name + '_loo_method')),
+                 **string_arrays('vocabulary', [row_hash[k] for k in features]),
+                 **string_arrays('rules', table.rules), **string_arrays('opts', table.opts))
+        os.replace(fname_tmp, self.logreg_state_file(name))
+
     def debug_feature_vector(self,rule_substring=r'google.com/pagead'):
-        for j, rule in enumerate(self.bad_rules):
+        for j, rule in enumerate(self.bad_table.rules):
             if rule.find(rule_substring) >= 0: break
         col = j
-        print(self.bad_rules[col])
+        print(self.bad_table.rules[col])
         _, rows = self.bad_fv_mat[col,:].nonzero()  # fv_mat is transposed
         print(rows)
         for row in rows:
             print('Row {:d}: {}:: {:g}'.format(row, self.bad_row_hash[int(row)], self.bad_fv_mat[col, row]))
 
-    def logit_fit_method_sample_weights(self):
+    def logit_fit_method_sample_weights(self, table, exception_flag=False):
         # weights for LogisticRegression.fit()
-        self.good_w_all = np.ones(len(self.good_y_all))
-        self.bad_w_all = np.ones(len(self.bad_y_all))
+        w = np.ones(len(table))
+        if exception_flag: return w
 
+        w += [1/max(1,len(rule)) for rule in table.rules]  # slight disadvantage for longer rules
         # add more weight for each of these regex matches
-        for i, rule in enumerate(self.bad_rules):
-            self.bad_w_all[i] += 1/max(1,len(rule))  # slight disadvantage for longer rules
-            for regex in high_weight_regex:
-                self.bad_w_all[i] += len(regex.findall(rule))
-            # these options have more weight
-            self.bad_w_all[i] += bool(thrdp_im_pup_os_option_re.search(self.bad_opts[i]))
-        return
+        counts = high_weight_regex_counts(table.rules)
+        for k in range(len(high_weight_regex)): w += counts[:, k]
+        # these options have more weight
+        w += [bool(thrdp_im_pup_os_option_re.search(opts)) for opts in table.opts]
+        return w
 
     def logreg_test_in_training(self):
         """fast, initial method: test vectors in the training data"""
 
-        self.good_fv_logreg = LogisticRegression(C=self.C, penalty='l2', solver='liblinear', tol=0.01)
-        self.bad_fv_logreg = LogisticRegression(C=self.C, penalty='l2', solver='liblinear', tol=0.01)
+        self.good_fv_logreg = self.logreg_estimator()
+        self.bad_fv_logreg = self.logreg_estimator()
 
+        # rules with identical features and labels are trained as one sample with their total weight
         good_x_test = self.good_X_all[self.good_columns]
-        good_X = self.good_X_all
-        good_y = self.good_y_all
-        good_w = self.good_w_all
+        good_X, good_y, good_w, self.good_samples = compact_training_rows(self.good_X_all, self.good_y_all, self.good_w_all)
+        self.good_X_train, self.good_y_train, self.good_w_train = good_X, good_y, good_w
 
         bad_x_test = self.bad_X_all[self.bad_columns]
-        bad_X = self.bad_X_all
-        bad_y = self.bad_y_all
-        bad_w = self.bad_w_all
+        bad_X, bad_y, bad_w, self.bad_samples = compact_training_rows(self.bad_X_all, self.bad_y_all, self.bad_w_all)
+        self.bad_X_train, self.bad_y_train, self.bad_w_train = bad_X, bad_y, bad_w
 
+        fit_time = time.time()
         if good_x_test.shape[0] > 0:
             self.good_fv_logreg.fit(good_X, good_y, sample_weight=good_w)
             self.good_signal = self.good_fv_logreg.decision_function(good_x_test)
         if bad_x_test.shape[0] > 0:
             self.bad_fv_logreg.fit(bad_X, bad_y, sample_weight=bad_w)
             self.bad_signal = self.bad_fv_logreg.decision_function(bad_x_test)
+        fit_time = time.time() - fit_time
+
+        if self.scorer == 'compare':
+            import scipy.stats as spst
+            numpy_fit_time = time.time()
+            good_numpy_signal = self.logreg_estimator('numpy').fit(good_X, good_y, sample_weight=good_w).decision_function(good_x_test)
+            bad_numpy_signal = self.logreg_estimator('numpy').fit(bad_X, bad_y, sample_weight=bad_w).decision_function(bad_x_test)
+            numpy_fit_time = time.time() - numpy_fit_time
+            print("\nScorer fit times: liblinear {:.2f} s, NumPy {:.2f} s; rank correlation of their signals: good {:.4f}, bad {:.4f}".format(
+                fit_time, numpy_fit_time,
+                spst.spearmanr(good_numpy_signal, self.good_signal)[0] if len(self.good_signal) > 1 else np.nan,
+                spst.spearmanr(bad_numpy_signal, self.bad_signal)[0] if len(self.bad_signal) > 1 else np.nan), flush=True)
         return
 
+    def logreg_estimator(self, scorer=None):
+        if (scorer or self.scorer) == 'numpy': return NumpyLogisticRegression(C=self.C)
+        return LogisticRegression(C=self.C, penalty='l2', solver='liblinear', tol=0.01)
+
     def logreg_sliding_window(self):
         """bootstrap the signal strengths by removing test vectors from training"""
 
@@ -370,253 +597,128 @@ e.g. non-domain specific popups or images."""
             bad_preidx = np.array([e[0] for e in sorted(enumerate(self.bad_signal),key=lambda e: e[1],reverse=True)],dtype=int)[:int(np.ceil(1.4*self.bad_rule_max))]
             self.bad_columns = self.bad_columns[bad_preidx]
 
-        # multithreaded loop for speed
-        use_blocked_not_sklearn_mp = True  # it's a lot faster to block it yourself
-        if use_blocked_not_sklearn_mp:
-            # init w/ target-in-training results
-            good_fv_logreg = copy.deepcopy(self.good_fv_logreg)
-            good_fv_logreg.penalty = 'l2'
-            good_fv_logreg.solver = 'sag'
-            good_fv_logreg.warm_start = True
-            good_fv_logreg.n_jobs = 1  # achieve parallelism via block processing
-            bad_fv_logreg = copy.deepcopy(self.bad_fv_logreg)
-            bad_fv_logreg.penalty = 'l2'
-            bad_fv_logreg.solver = 'sag'
-            bad_fv_logreg.warm_start = True
-            bad_fv_logreg.n_jobs = 1  # achieve parallelism via block processing
-            if False:  # debug mp: turn off multiprocessing with a monkeypatch
-                class NotAMultiProcess(mp.Process):
-                    def start(self): self.run()
-                    def join(self): pass
-                mp.Process = NotAMultiProcess
-
-            # this is probably efficient with Linux's copy-on-write fork(); unsure about BSD/macOS
-            # must refactor to use shared Array() [along with warm_start coeff's] to ensure
-            # see https://stackoverflow.com/questions/5549190/is-shared-readonly-data-copied-to-different-processes-for-python-multiprocessing/
-
-            # distribute training and tests across multiprocessors
-            def training_op(queue, X_all, y_all, w_all, fv_logreg, columns, column_block):
-                """Training and test operation put into a mp.Queue.
-                columns[column_block] and signal[column_block] are the rule columns and corresponding signal strengths
-                """
-                res = np.zeros(len(column_block))
-                for k in range(len(column_block)):
-                    mask = np.zeros(len(y_all), dtype=bool)
-                    mask[columns[column_block[k]]] = True
-                    mask = np.logical_not(mask)
-
-                    x_test = X_all[np.logical_not(mask)]
-                    X = X_all[mask]
-                    y = y_all[mask]
-                    w = w_all[mask]
-
-                    fv_logreg.fit(X, y, sample_weight=w)
-                    res[k] = fv_logreg.decision_function(x_test)[0]
-                queue.put((column_block,res))  # signal[column_block] = res
-                return
-
-            num_threads = mp.cpu_count()
-
-            # good
-            q = mp.Queue()
-            jobs = []
-            self.good_signal = np.zeros(len(self.good_columns))
-            block_length = len(self.good_columns) // num_threads
-            column_block = np.arange(0, block_length)
-            while len(column_block) > 0:
-                column_block = column_block[np.where(column_block < len(self.good_columns))]
-                fv_logreg = copy.deepcopy(good_fv_logreg)  # each process gets its own .coeff_'s
-                column_block_copy = np.copy(column_block)  # each process gets its own block of columns
-                p = mp.Process(target=training_op, args=(q, self.good_X_all, self.good_y_all, self.good_w_all, fv_logreg, self.good_columns, column_block_copy))
-                p.start()
-                jobs.append(p)
-                column_block += len(column_block)
-            # process the results in the queue
-            for i in range(len(jobs)):
-                column_block, res = q.get()
-                self.good_signal[column_block] = res
-            # join all jobs and wait for them to complete
-            for p in jobs: p.join()
-
-            # bad
-            q = mp.Queue()
-            jobs = []
-            self.bad_signal = np.zeros(len(self.bad_columns))
-            block_length = len(self.bad_columns) // num_threads
-            column_block = np.arange(0, block_length)
-            while len(column_block) > 0:
-                column_block = column_block[np.where(column_block < len(self.bad_columns))]
-                fv_logreg = copy.deepcopy(bad_fv_logreg)   # each process gets its own .coeff_'s
-                column_block_copy = np.copy(column_block)  # each process gets its own block of columns
-                p = mp.Process(target=training_op, args=(q, self.bad_X_all, self.bad_y_all, self.bad_w_all, fv_logreg, self.bad_columns, column_block_copy))
-                p.start()
-                jobs.append(p)
-                column_block += len(column_block)
-            # process the results in the queue
-            for i in range(len(jobs)):
-                column_block, res = q.get()
-                self.bad_signal[column_block] = res
-            # join all jobs and wait for them to complete
-            for p in jobs: p.join()
-        else:  # if use_blocked_not_sklearn_mp:
-            def training_op(X_all, y_all, w_all, fv_logreg, columns, signal):
-                """Training and test operations reusing results with multiprocessing."""
-                res = np.zeros(len(signal))
-                for k in range(len(res)):
-                    mask = np.zeros(len(y_all), dtype=bool)
-                    mask[columns[k]] = True
-                    mask = np.logical_not(mask)
-
-                    x_test = X_all[np.logical_not(mask)]
-                    X = X_all[mask]
-                    y = y_all[mask]
-                    w = w_all[mask]
-
-                    fv_logreg.fit(X, y, sample_weight=w)
-                    res[k] = fv_logreg.decision_function(x_test)[0]
-                signal[:] = res
-                return
-            # good
-            training_op(self.good_X_all, self.good_y_all, self.good_w_all, self.good_fv_logreg, self.good_columns, self.good_signal)
-            # bad
-            training_op(self.bad_X_all, self.bad_y_all, self.bad_w_all, self.bad_fv_logreg, self.bad_columns, self.bad_signal)
+        # only rules without a saved signal from the same method are refit
+        loo_method = '{}/{}'.format('approx' if self.sliding_window_method == 'approx' else 'exact',
+                                    'numpy' if self.scorer == 'numpy' else 'sklearn')
+        refit_columns = {}
+        for name in ['good', 'bad']:
+            loo_signal_all = getattr(self, name + '_loo_signal_all')
+            if getattr(self, name + '_loo_method') != loo_method or self.sliding_window_method == 'verify': loo_signal_all[:] = np.nan
+            setattr(self, name + '_loo_method', loo_method)
+            columns = getattr(self, name + '_columns')
+            refit_columns[name] = columns[np.isnan(loo_signal_all[columns])]
+
+        if self.sliding_window_method in ['approx', 'verify']:
+            approx_signal = {name: logreg_loo_decision_function(getattr(self, name + '_fv_logreg'), getattr(self, name + '_X_train'),
+                                                                getattr(self, name + '_y_train'), getattr(self, name + '_w_train'),
+                                                                getattr(self, name + '_samples')[refit_columns[name]],
+                                                                getattr(self, name + '_w_all')[refit_columns[name]])
+                             for name in ['good', 'bad']}
+        if self.sliding_window_method == 'approx':
+            refit_signal = approx_signal
+        else:
+            refit_signal = self.logreg_sliding_window_exact(refit_columns)
+        for name in ['good', 'bad']:
+            loo_signal_all = getattr(self, name + '_loo_signal_all')
+            loo_signal_all[refit_columns[name]] = refit_signal[name]
+            setattr(self, name + '_signal', loo_signal_all[getattr(self, name + '_columns')])
+
+        if self.sliding_window_method == 'verify':
+            import scipy.stats as spst
+            print("\nSliding window rank correlation of approximate and exact leave-one-out signals: good {:.4f}, bad {:.4f}".format(
+                spst.spearmanr(approx_signal['good'], self.good_signal)[0] if len(self.good_signal) > 1 else np.nan,
+                spst.spearmanr(approx_signal['bad'], self.bad_signal)[0] if len(self.bad_signal) > 1 else np.nan), flush=True)
         return
 
+    def logreg_sliding_window_exact(self, refit_columns):
+        """refit the model with each test vector removed from training
+
+The training data are placed in shared memory once for a pool of workers, each of which reuses one warm-started
+estimator. Blocks of columns are handed out as workers become free."""
+        refit_logregs = {}
+        for name in ['good', 'bad']:
+            fv_logreg = copy.deepcopy(getattr(self, name + '_fv_logreg'))
+            fv_logreg.penalty = 'l2'
+            fv_logreg.solver = 'sag'
+            fv_logreg.warm_start = True
+            fv_logreg.n_jobs = 1  # achieve parallelism via block processing
+            refit_logregs[name] = fv_logreg
+        shared_blocks, shared_spec = shared_memory_arrays(
+            {name + '_' + key: array for name in ['good', 'bad']
+             for (key, array) in csr_arrays(getattr(self, name + '_X_train'), getattr(self, name + '_y_train'),
+                                            getattr(self, name + '_w_train')).items()})
+        num_workers = mp.cpu_count()
+        try:
+            with cf.ProcessPoolExecutor(max_workers=num_workers, initializer=sliding_window_worker_init,
+                                        initargs=(shared_spec, refit_logregs)) as executor:
+                refits = {}
+                signal = {}
+                for name in ['good', 'bad']:
+                    columns = refit_columns[name]
+                    samples = getattr(self, name + '_samples')[columns]
+                    weights = getattr(self, name + '_w_all')[columns]
+                    signal[name] = np.zeros(len(columns))
+                    # several blocks per worker so that the load stays balanced
+                    block_length = max(1, min(64, len(columns) // (4*num_workers)))
+                    for k in range(0, len(columns), block_length):
+                        refits[executor.submit(sliding_window_refit, name, samples[k:k + block_length],
+                                               weights[k:k + block_length])] = (name, k)
+                for refit in cf.as_completed(refits):
+                    name, k = refits[refit]
+                    res = refit.result()
+                    signal[name][k:k + len(res)] = res
+        finally:
+            for shm in shared_blocks.values():
+                shm.close()
+                shm.unlink()
+        return signal
+
     def parse_easylist_rules(self):
-        for rule in self.good_rules: self.easylist_to_javascript_vars(rule)
-        for rule in self.bad_rules: self.easylist_to_javascript_vars(rule)
-        ordered_unique_all_js_var_lists()
+        for (table, exception_flag) in [(self.good_table, True), (self.bad_table, False)]:
+            for (rule, category, pattern) in zip(table.rules, table.categories, table.patterns):
+                self.easylist_to_javascript_vars(rule, category, pattern, exception_flag)
         return
 
-    def easylist_to_javascript_vars(self,rule,ignore_huge_url_regex_rule_list=False):
+    def easylist_to_javascript_vars(self,rule,category,pattern,exception_flag=False,ignore_huge_url_regex_rule_list=False):
+        """Append a good (exception) or bad rule to the JS variable of its category."""
+        js_var = self.easylist_js_variable(rule,category,pattern,exception_flag,ignore_huge_url_regex_rule_list)
+        if js_var is None: return
+        js_var_name, pattern = js_var
+        globals()[js_var_name].append(pattern)
+
+    def easylist_js_variable(self,rule,category,pattern,exception_flag=False,ignore_huge_url_regex_rule_list=False):
+        """The JS variable name and pattern of a good (exception) or bad rule, or None for rules left out of the PAC.
+category and pattern are the rule's, from its lexed record."""
         rule = rule.rstrip()
-        rule_orig = rule
-        exception_flag = exception_filter(rule)  # block default; pass if True
-        rule = exception_re.sub(r'\1', rule)
-        option_exception_re = not3dimppuposgh_option_exception_re  # ignore these options by default
-        opts = ''  # default: no options in the rule
-        if re_test(option_re, rule):
-            opts = option_re.sub(r'\2', rule)
-            # domain-specific and other option exceptions: ignore
-            # too many rules (>~ 10k) bog down the browser; make reasonable exclusions here
-            rule = option_re.sub(r'\1', rule)  # delete all the options and continue
-        # ignore these cases
-        # comment case: ignore
-        if re_test(comment_re, rule): return
-        # block default or pass exception
-        if exception_flag:
-            option_exception_re = not3dimppuposgh_option_exception_re  # ignore these options within exceptions
-            if not self.exceptions_include_flag: return
-        # specific options: ignore
-        if re_test(option_exception_re, opts): return
-        # blank url case: ignore
-        if re_test(httpempty_re, rule): return
         # blank line case: ignore
         if not rule: return
-        # treat each of the these cases separately, here and in Javascript
-        # regex case
-        if re_test(regex_re, rule):
-            if regex_ignore_test(rule): return
-            rule = regex_re.sub(r'\1', rule)
-            if exception_flag:
-                good_url_regex.append(rule)
-            else:
-                if not re_test(badregex_regex_filters_re,
-                               rule): return  # limit bad regex's to those in the filter
-                bad_url_regex.append(rule)
-            return
-        # now that regex's are handled, delete unnecessary wildcards, e.g. /.../*
-        rule = wildcard_begend_re.sub(r'\1', rule)
-        # domain anchors, || or '|http://a.b' -> domain anchor 'a.b' for regex efficiency in JS
-        if re_test(domain_anch_re, rule) or re_test(scheme_anchor_re, rule):
-            # strip off initial || or |scheme://
-            if re_test(domain_anch_re, rule):
-                rule = domain_anch_re.sub(r'\1', rule)
-            elif re_test(scheme_anchor_re, rule):
-                rule = scheme_anchor_re.sub("", rule)
-            # host subcase
-            if re_test(da_hostonly_re, rule):
-                rule = da_hostonly_re.sub(r'\1', rule)
-                if not re_test(wild_anch_sep_exc_re, rule):  # exact subsubcase
-                    if not re_test(badregex_regex_filters_re, rule):
-                        return  # limit bad regex's to those in the filter
-                    if exception_flag:
-                        good_da_host_exact.append(rule)
-                    else:
-                        bad_da_host_exact.append(rule)
-                    return
-                else:  # regex subsubcase
-                    if regex_ignore_test(rule): return
-                    if exception_flag:
-                        good_da_host_regex.append(rule)
-                    else:
-                        if not re_test(badregex_regex_filters_re,
-                                       rule): return  # limit bad regex's to those in the filter
-                        bad_da_host_regex.append(rule)
-                    return
-            # hostpath subcase
-            if re_test(da_hostpath_re, rule):
-                rule = da_hostpath_re.sub(r'\1', rule)
-                if not re_test(wild_sep_exc_noanch_re, rule) and re_test(pathend_re, rule):  # exact subsubcase
-                    rule = re.sub(r'\|$', '', rule)  # strip EOL anchors
-                    if not re_test(badregex_regex_filters_re, rule):
-                        return  # limit bad regex's to those in the filter
-                    if exception_flag:
-                        good_da_hostpath_exact.append(rule)
-                    else:
-                        bad_da_hostpath_exact.append(rule)
-                    return
-                else:  # regex subsubcase
-                    if regex_ignore_test(rule): return
-                    # ignore option rules for some regex rules
-                    if re_test(alloption_exception_re, opts): return
-                    if exception_flag:
-                        good_da_hostpath_regex.append(rule)
-                    else:
-                        if not re_test(badregex_regex_filters_re,
-                                       rule): return  # limit bad regex's to those in the filter
-                        bad_da_hostpath_regex.append(rule)
-                    return
-            # hostpathquery default case
-            if True:
-                # if re_test(re.compile(r'^go\.'),rule):
-                #     pass
-                if regex_ignore_test(rule): return
-                if exception_flag:
-                    good_da_regex.append(rule)
-                else:
-                    bad_da_regex.append(rule)
-                return
-        # all other non-regex patterns
-        if True:
-            if regex_ignore_test(rule): return
-            if not ignore_huge_url_regex_rule_list:
-                if re_test(alloption_exception_re, opts): return
-                if exception_flag:
-                    good_url_parts.append(rule)
-                else:
-                    if not re_test(badregex_regex_filters_re,
-                                   rule): return  # limit bad regex's to those in the filter
-                    bad_url_parts.append(rule)
-                return  # superfluous return
+        # block default or pass exception
+        if exception_flag and not self.exceptions_include_flag: return
+        if regex_ignore_test(rule): return
+        # treat each of the rule categories separately, here and in Javascript
+        if category == 'url_parts' and ignore_huge_url_regex_rule_list: return
+        # limit bad regex's to those in the filter
+        if (category in filtered_exact_categories or (not exception_flag and category not in unfiltered_bad_categories)) \
+                and not badregex_filter_test(pattern): return
+        return ('good_' if exception_flag else 'bad_') + category, pattern
 
     def create_pac_file(self):
         self.proxy_pac_init()
         self.proxy_pac = self.proxy_pac_preamble \
                     + "\n".join(["// " + l for l in self.easylist_strategy.split("\n")]) \
                     + self.js_init_object('good_da_host_exact') \
-                    + self.js_init_regexp('good_da_host_regex', True) \
-                    + self.js_init_object('good_da_hostpath_exact') \
-                    + self.js_init_regexp('good_da_hostpath_regex', True) \
+                    + self.js_init_regexp('good_da_host_regex', True, bucket='host') \
+                    + self.js_init_hostpath_object('good_da_hostpath_exact') \
+                    + self.js_init_regexp('good_da_hostpath_regex', True, bucket='host') \
                     + self.js_init_regexp('good_da_regex', True) \
                     + self.js_init_object('good_da_host_exceptions_exact') \
-                    + self.js_init_object('bad_da_host_exact') \
-                    + self.js_init_regexp('bad_da_host_regex', True) \
-                    + self.js_init_object('bad_da_hostpath_exact') \
-                    + self.js_init_regexp('bad_da_hostpath_regex', True) \
+                    + self.js_init_object('bad_da_host_exact', bloom_flag=True) \
+                    + self.js_init_regexp('bad_da_host_regex', True, bucket='host') \
+                    + self.js_init_hostpath_object('bad_da_hostpath_exact', bloom_flag=True) \
+                    + self.js_init_regexp('bad_da_hostpath_regex', True, bucket='host') \
                     + self.js_init_regexp('bad_da_regex', True) \
-                    + self.js_init_regexp('good_url_parts') \
-                    + self.js_init_regexp('bad_url_parts') \
+                    + self.js_init_regexp('good_url_parts', bucket='keyword') \
+                    + self.js_init_regexp('bad_url_parts', bucket='keyword') \
                     + self.js_init_regexp('good_url_regex', regex_flag=True) \
                     + self.js_init_regexp('bad_url_regex', regex_flag=True) \
                     + self.proxy_pac_postamble
@@ -641,6 +743,53 @@ e.g. non-domain specific popups or images."""
         with open(os.path.join(self.easylist_dir, 'proxy.pac'), 'w', encoding='utf-8') as fd:
             fd.write(self.proxy_pac)
 
+        if self.verify_regex_file: self.verify_assembled_regexes()
+
+    def verify_assembled_regexes(self):
+        """Check that each factored regex matches the same URL strings as its flat alternation.
+Each URL is tested as the PAC tests it: whole, without scheme, without scheme and query, and its host."""
+        with open(self.verify_regex_file, 'r', encoding='utf-8') as fd:
+            urls = [url.strip() for url in fd if url.strip()]
+        strings = set()
+        for url in urls:
+            url_noscheme = re.sub(r'^[\w*+-]{2,15}:/{0,2}', '', url)
+            strings.update([url, url_noscheme, re.sub(r'\?.*$', '', url_noscheme), re.sub(r'[/:?].*$', '', url_noscheme)])
+        # a pattern deeper than the recursion limit
+        long_patterns = ['a' * 1200 + r'\.example/', 'a' * 1199 + 'b', 'zzq']
+        strings.update(['a' * 1200 + '.example/', 'a' * 1199 + '.example/', 'a' * 1199 + 'b', 'a' * 1198 + 'b'])
+        strings = sorted(strings)
+        for (array_name, domain_anchor_replace, flat, factored) in self.assembled_regexes + \
+                [('long_pattern', '', '|'.join(long_patterns), regex_assemble(long_patterns))]:
+            flat_re = re.compile(js_regex_to_python(domain_anchor_replace + '(?:' + flat + ')'), re.IGNORECASE)
+            factored_re = re.compile(js_regex_to_python(domain_anchor_replace + '(?:' + factored + ')'), re.IGNORECASE)
+            flat_time = time.time()
+            flat_matches = [bool(flat_re.search(x)) for x in strings]
+            flat_time = time.time() - flat_time
+            factored_time = time.time()
+            factored_matches = [bool(factored_re.search(x)) for x in strings]
+            factored_time = time.time() - factored_time
+            mismatches = [x for (x, a, b) in zip(strings, flat_matches, factored_matches) if a != b]
+            print("{}: factored regex {:d} bytes, {:.3f} s; flat {:d} bytes, {:.3f} s; {:d} of {:d} strings matched, {:d} mismatches{}".format(
+                array_name, len(factored), factored_time, len(flat), flat_time, sum(flat_matches), len(strings), len(mismatches),
+                ', e.g. ' + mismatches[0] if mismatches else ''), flush=True)
+        for (array_name, bucket_type, domain_anchor_replace, flat, buckets, rest) in self.bucketed_regexes:
+            flat_re = re.compile(js_regex_to_python(domain_anchor_replace + '(?:' + flat + ')'), re.IGNORECASE)
+            bucket_res = {key: re.compile(js_regex_to_python(domain_anchor_replace + '(?:' + bucket + ')'), re.IGNORECASE)
+                          for (key, bucket) in buckets.items()}
+            rest_re = re.compile(js_regex_to_python(domain_anchor_replace + '(?:' + rest + ')'), re.IGNORECASE) if rest else None
+            # the keys the PAC probes: the url's keywords, or the last two and last one labels of its host
+            if bucket_type == 'keyword': string_keys = lambda x: url_keywords_re.findall(x.lower())
+            else: string_keys = lambda x: host_keys(re.sub(r'[/:?].*$', '', re.sub(r'^[\w*+-]{2,15}:/{0,2}', '', x)))
+            flat_matches = [bool(flat_re.search(x)) for x in strings]
+            bucket_time = time.time()
+            bucket_matches = [any(bucket_res[key].search(x) for key in string_keys(x) if key in bucket_res)
+                              or bool(rest_re and rest_re.search(x)) for x in strings]
+            bucket_time = time.time() - bucket_time
+            mismatches = [x for (x, a, b) in zip(strings, flat_matches, bucket_matches) if a != b]
+            print("{}: {:d} {} buckets, largest {:d} bytes, unbucketed {:d} bytes, {:.3f} s; {:d} of {:d} strings matched, {:d} mismatches{}".format(
+                array_name, len(buckets), bucket_type, max(map(len, buckets.values()), default=0), len(rest), bucket_time,
+                sum(flat_matches), len(strings), len(mismatches), ', e.g. ' + mismatches[0] if mismatches else ''), flush=True)
+
     def proxy_pac_init(self):
         self.pac_proxy = 'PROXY {}'.format(self.proxy_host_port) if self.proxy_host_port else 'DIRECT'
 
@@ -884,7 +1033,7 @@ var bad_schemes_RegExp = RegExp("^(?:ftp|sftp|tftp|ftp-data|rsync|finger|gopher)
 var schemepart_RegExp = RegExp("^([\\\\w*+-]{2,15}):\\\\/{0,2}","i");
 var hostpart_RegExp = RegExp("^((?:[\\\\w-]+\\\\.)+[a-zA-Z0-9-]{2,24}\\\\.?)", "i");
 var querypart_RegExp = RegExp("^((?:[\\\\w-]+\\\\.)+[a-zA-Z0-9-]{2,24}\\\\.?[\\\\w~%.\\\\/^*-]*)(\\\\??\\\\S*?)$", "i");
-var domainpart_RegExp = RegExp("^(?:[\\\\w-]+\\\\.)*((?:[\\\\w-]+\\\\.)[a-zA-Z0-9-]{2,24})\\\\.?", "i");
+var portpart_RegExp = /^:\d+/;
 
 //////////////////////////////////////////////////
 // Define the is_ipv4_address function and vars //
@@ -914,6 +1063,122 @@ var hasOwnProperty = function(obj, prop) {
     return obj.hasOwnProperty(prop);
 }
 
+// Packed keys: one sorted string of keys delimited by "|", which parses much faster than an object literal
+// It's split on first use, then binary searched by its hasOwnProperty method, so it works wherever object hashes do
+function PackedKeys(packed) {
+    this.packed = packed;
+    this.keys = null;
+}
+PackedKeys.prototype.hasOwnProperty = function(key) {
+    var keys = this.keys || (this.keys = this.packed.split("|"));
+    var lo = 0, hi = keys.length;
+    while (lo < hi) {
+        var mid = (lo + hi) >> 1;
+        if (keys[mid] < key) lo = mid + 1;
+        else hi = mid;
+    }
+    return lo < keys.length && keys[lo] === key;
+}
+
+// Bloom filter keys: a table with a Bloom filter of its keys in base64, tested before the table itself
+// Bit positions are (h1 + i*h2) % n_bits for i < n_hashes, from the 32 bit FNV-1a hash h1 of the key and its xorshift h2,
+// so most keys that aren't in the table are rejected after a few bits, and the rest are confirmed in the table
+function BloomKeys(bits, n_bits, n_hashes, keys) {
+    this.bits = bits;
+    this.n_bits = n_bits;
+    this.n_hashes = n_hashes;
+    this.keys = keys;
+}
+BloomKeys.prototype.hasOwnProperty = function(key) {
+    var h1 = 2166136261;
+    for (var i = 0; i < key.length; i++) {
+        // multiply by the FNV prime 16777619 == 2^24 + 2^8 + 2^7 + 2^4 + 2^1 + 1, modulo 2^32
+        h1 ^= key.charCodeAt(i);
+        h1 = (h1 + (h1 << 1) + (h1 << 4) + (h1 << 7) + (h1 << 8) + (h1 << 24)) >>> 0;
+    }
+    var h2 = h1 ^ (h1 << 13);
+    h2 ^= h2 >>> 17;
+    h2 = (h2 ^ (h2 << 5)) >>> 0;
+    for (i = 0; i < this.n_hashes; i++) {
+        var bit = (h1 + i*h2) % this.n_bits;
+        var c = this.bits.charCodeAt(bit/6 | 0);
+        // base64 digit value: A-Z, a-z, 0-9, +, /
+        c = c >= 97 ? c - 71 : c >= 65 ? c - 65 : c >= 48 ? c + 4 : c == 43 ? 62 : 63;
+        if (!((c >> (5 - bit % 6)) & 1)) return false;
+    }
+    return this.keys.hasOwnProperty(key);
+}
+BloomKeys.prototype.get = function(key) {
+    return this.keys[key];
+}
+
+// Object keys: an object hash with the same hasOwnProperty and get methods as BloomKeys, for the paths of a host
+function ObjectKeys(keys) {
+    this.keys = keys;
+}
+ObjectKeys.prototype.hasOwnProperty = function(key) {
+    return this.keys.hasOwnProperty(key);
+}
+ObjectKeys.prototype.get = function(key) {
+    return this.keys[key];
+}
+
+// Test a host, or a url without scheme, and then each parent domain, in an object hash: e.g.
+// a.b.example.com/path, b.example.com/path, example.com/path, com/path
+// Probes are bounded by the host's label count; suffix_flag is false for IPv4 hosts, which are tested as is
+var hasOwnPropertyDomainSuffix = function(obj, host_url, suffix_flag) {
+    var host_end = host_url.indexOf("/");
+    if (host_end < 0) host_end = host_url.length;
+    var k = 0;
+    while (k < host_end) {
+        if (obj.hasOwnProperty(host_url.substring(k))) return true;
+        if (!suffix_flag) break;
+        k = host_url.indexOf(".", k) + 1;
+        if (k == 0) break;
+    }
+    return false;
+}
+
+// Test a url in the RegExp's of its keywords' buckets, then in the RegExp of the rules without a keyword
+// Keywords are the url's runs of 3 or more [a-z0-9%]; a rule's keyword is one of these in every url it matches
+var url_keywords_RegExp = /[a-z0-9%]{3,}/g;
+var keywordBucketsTest = function(buckets, regexp, url, url_keywords) {
+    for (var i = 0; i < url_keywords.length; i++) {
+        if (buckets.hasOwnProperty(url_keywords[i]) && buckets[url_keywords[i]].test(url)) return true;
+    }
+    return regexp.test(url);
+}
+
+// Test a host, and then each parent domain, in an object hash of paths by host, and whether a url path begins with
+// one of its paths
+var hasOwnPropertyDomainSuffixPath = function(obj, host, url_path, suffix_flag) {
+    var k = 0;
+    while (k < host.length) {
+        var host_suffix = k > 0 ? host.substring(k) : host;
+        if (obj.hasOwnProperty(host_suffix)) {
+            var paths = obj.get(host_suffix);
+            for (var i = 0; i < paths.length; i++) {
+                if (url_path.lastIndexOf(paths[i], 0) == 0) return true;
+            }
+        }
+        if (!suffix_flag) break;
+        k = host.indexOf(".", k) + 1;
+        if (k == 0) break;
+    }
+    return false;
+}
+
+// Test a string in the RegExp's of the host's buckets, keyed by the last two labels and the last label of the host,
+// then in the RegExp of the rules without a literal host
+var hostBucketsTest = function(buckets, regexp, host, str) {
+    var k = host.lastIndexOf(".");
+    var key = host.substring(host.lastIndexOf(".", k - 1) + 1);
+    if (buckets.hasOwnProperty(key) && buckets[key].test(str)) return true;
+    key = host.substring(k + 1);
+    if (k >= 0 && buckets.hasOwnProperty(key) && buckets[key].test(str)) return true;
+    return regexp.test(str);
+}
+
 /////////////////////
 // Done Setting Up //
 /////////////////////
@@ -944,21 +1209,19 @@ function EasyListFindProxyForURL(url, host)
 
     // Remove the scheme and extract the path for regex efficiency
     var url_noscheme = url.replace(schemepart_RegExp,"");
-    var url_pathonly = url_noscheme.replace(hostpart_RegExp,"");
+    // the path follows the host and any port; hostpart_RegExp misses IPv4 hosts, single labels and 1 character TLDs
+    var url_pathonly = url_noscheme.lastIndexOf(host, 0) == 0 ? url_noscheme.substring(host.length).replace(portpart_RegExp,"")
+        : url_noscheme.replace(hostpart_RegExp,"");
     var url_noquery = url_noscheme.replace(querypart_RegExp,"$1");
-    // Remove the server name from the url and host if host is not an IPv4 address
-    var url_noserver = !host_is_ipv4 ? url_noscheme.replace(domainpart_RegExp,"$1") : url_noscheme;
-    var url_noservernoquery = !host_is_ipv4 ? url_noquery.replace(domainpart_RegExp,"$1") : url_noscheme;
-    var host_noserver =  !host_is_ipv4 ? host.replace(domainpart_RegExp,"$1") : host;
+    var url_keywords = url.toLowerCase().match(url_keywords_RegExp) || [];
+    // Parent domains of the host are matched by walking the host's labels in the exact hashes,
+    // and by the domain anchor prefix in the regex's
 
     // Debugging results
     if (debug_flag && alert_flag) {
         alert("url_noscheme is: " + url_noscheme);
         alert("url_pathonly is: " + url_pathonly);
         alert("url_noquery is: " + url_noquery);
-        alert("url_noserver is: " + url_noserver);
-        alert("url_noservernoquery is: " + url_noservernoquery);
-        alert("host_noserver is: " + host_noserver);
     }
 
     // Short circuit to blackhole for good_da_host_exceptions
@@ -1026,9 +1289,9 @@ function EasyListFindProxyForURL(url, host)
         // PASS LIST:   domains matched here will always be allowed.         //
         ///////////////////////////////////////////////////////////////////////
 
-        if ( (good_da_host_exact_flag && (hasOwnProperty(good_da_host_exact_JSON,host_noserver)||hasOwnProperty(good_da_host_exact_JSON,host)))
+        if ( (good_da_host_exact_flag && hasOwnPropertyDomainSuffix(good_da_host_exact_JSON,host,!host_is_ipv4))
             && !hasOwnProperty(good_da_host_exceptions_exact_JSON,host) ) {
-                alert_flag && alert("HTTPS PASS: " + host + ", " + host_noserver);
+                alert_flag && alert("HTTPS PASS: " + host);
             return proxy;
         }
 
@@ -1036,8 +1299,8 @@ function EasyListFindProxyForURL(url, host)
         // BLOCK LIST:	stuff matched here here will be blocked //
         //////////////////////////////////////////////////////////
 
-        if ( (bad_da_host_exact_flag && (hasOwnProperty(bad_da_host_exact_JSON,host_noserver)||hasOwnProperty(bad_da_host_exact_JSON,host))) ) {
-            alert_flag && alert("HTTPS blackhole: " + host + ", " + host_noserver);
+        if ( (bad_da_host_exact_flag && hasOwnPropertyDomainSuffix(bad_da_host_exact_JSON,host,!host_is_ipv4)) ) {
+            alert_flag && alert("HTTPS blackhole: " + host);
             return blackhole;
         }
     }
@@ -1053,14 +1316,14 @@ function EasyListFindProxyForURL(url, host)
         ///////////////////////////////////////////////////////////////////////
 
         if ( !hasOwnProperty(good_da_host_exceptions_exact_JSON,host)
-            && ((good_da_host_exact_flag && (hasOwnProperty(good_da_host_exact_JSON,host_noserver)||hasOwnProperty(good_da_host_exact_JSON,host))) ||  // fastest test first
+            && ((good_da_host_exact_flag && hasOwnPropertyDomainSuffix(good_da_host_exact_JSON,host,!host_is_ipv4)) ||  // fastest test first
                 (use_pass_rules_parts_flag &&
-                    (good_da_hostpath_exact_flag && (hasOwnProperty(good_da_hostpath_exact_JSON,url_noservernoquery)||hasOwnProperty(good_da_hostpath_exact_JSON,url_noquery)) ) ||
+                    (good_da_hostpath_exact_flag && hasOwnPropertyDomainSuffixPath(good_da_hostpath_exact_JSON,host,url_pathonly,!host_is_ipv4)) ||
                     // test logic: only do the slower test if the host has a (non)suspect fqdn
-                    (good_da_host_regex_flag && (good_da_host_regex_RegExp.test(host_noserver)||good_da_host_regex_RegExp.test(host))) ||
-                    (good_da_hostpath_regex_flag && (good_da_hostpath_regex_RegExp.test(url_noservernoquery)||good_da_hostpath_regex_RegExp.test(url_noquery))) ||
-                    (good_da_regex_flag && (good_da_regex_RegExp.test(url_noserver)||good_da_regex_RegExp.test(url_noscheme))) ||
-                    (good_url_parts_flag && good_url_parts_RegExp.test(url)) ||
+                    (good_da_host_regex_flag && hostBucketsTest(good_da_host_regex_Hosts,good_da_host_regex_RegExp,host,host)) ||
+                    (good_da_hostpath_regex_flag && hostBucketsTest(good_da_hostpath_regex_Hosts,good_da_hostpath_regex_RegExp,host,url_noquery)) ||
+                    (good_da_regex_flag && good_da_regex_RegExp.test(url_noscheme)) ||
+                    (good_url_parts_flag && keywordBucketsTest(good_url_parts_Keywords,good_url_parts_RegExp,url,url_keywords)) ||
                     (good_url_regex_flag && good_url_regex_RegExp.test(url)))) ) {
             return proxy;
         }
@@ -1070,27 +1333,22 @@ function EasyListFindProxyForURL(url, host)
         //////////////////////////////////////////////////////////
         // Debugging results
         if (debug_flag && alert_flag) {
-            alert("hasOwnProperty(bad_da_host_exact_JSON," + host_noserver + "): " + (bad_da_host_exact_flag && hasOwnProperty(bad_da_host_exact_JSON,host_noserver)));
-            alert("hasOwnProperty(bad_da_host_exact_JSON," + host + "): " + (bad_da_host_exact_flag && hasOwnProperty(bad_da_host_exact_JSON,host)));
-            alert("hasOwnProperty(bad_da_hostpath_exact_JSON," + url_noservernoquery + "): " + (bad_da_hostpath_exact_flag && hasOwnProperty(bad_da_hostpath_exact_JSON,url_noservernoquery)));
-            alert("hasOwnProperty(bad_da_hostpath_exact_JSON," + url_noquery + "): " + (bad_da_hostpath_exact_flag && hasOwnProperty(bad_da_hostpath_exact_JSON,url_noquery)));
-            alert("bad_da_host_regex_RegExp.test(" + host_noserver + "): " + (bad_da_host_regex_flag && bad_da_host_regex_RegExp.test(host_noserver)));
-            alert("bad_da_host_regex_RegExp.test(" + host + "): " + (bad_da_host_regex_flag && bad_da_host_regex_RegExp.test(host)));
-            alert("bad_da_hostpath_regex_RegExp.test(" + url_noservernoquery + "): " + (bad_da_hostpath_regex_flag && bad_da_hostpath_regex_RegExp.test(url_noservernoquery)));
-            alert("bad_da_hostpath_regex_RegExp.test(" + url_noquery + "): " + (bad_da_hostpath_regex_flag && bad_da_hostpath_regex_RegExp.test(url_noquery)));
-            alert("bad_da_regex_RegExp.test(" + url_noserver + "): " + (bad_da_regex_flag && bad_da_regex_RegExp.test(url_noserver)));
+            alert("hasOwnPropertyDomainSuffix(bad_da_host_exact_JSON," + host + "): " + (bad_da_host_exact_flag && hasOwnPropertyDomainSuffix(bad_da_host_exact_JSON,host,!host_is_ipv4)));
+            alert("hasOwnPropertyDomainSuffixPath(bad_da_hostpath_exact_JSON," + host + "," + url_pathonly + "): " + (bad_da_hostpath_exact_flag && hasOwnPropertyDomainSuffixPath(bad_da_hostpath_exact_JSON,host,url_pathonly,!host_is_ipv4)));
+            alert("hostBucketsTest(bad_da_host_regex_Hosts," + host + "): " + (bad_da_host_regex_flag && hostBucketsTest(bad_da_host_regex_Hosts,bad_da_host_regex_RegExp,host,host)));
+            alert("hostBucketsTest(bad_da_hostpath_regex_Hosts," + url_noquery + "): " + (bad_da_hostpath_regex_flag && hostBucketsTest(bad_da_hostpath_regex_Hosts,bad_da_hostpath_regex_RegExp,host,url_noquery)));
             alert("bad_da_regex_RegExp.test(" + url_noscheme + "): " + (bad_da_regex_flag && bad_da_regex_RegExp.test(url_noscheme)));
-            alert("bad_url_parts_RegExp.test(" + url + "): " + (bad_url_parts_flag && bad_url_parts_RegExp.test(url)));
+            alert("keywordBucketsTest(bad_url_parts_Keywords," + url + "): " + (bad_url_parts_flag && keywordBucketsTest(bad_url_parts_Keywords,bad_url_parts_RegExp,url,url_keywords)));
             alert("bad_url_regex_RegExp.test(" + url + "): " + (bad_url_regex_flag && bad_url_regex_RegExp.test(url)));
         }
 
-        if ( (bad_da_host_exact_flag && (hasOwnProperty(bad_da_host_exact_JSON,host_noserver)||hasOwnProperty(bad_da_host_exact_JSON,host))) ||  // fastest test first
-            (bad_da_hostpath_exact_flag && (hasOwnProperty(bad_da_hostpath_exact_JSON,url_noservernoquery)||hasOwnProperty(bad_da_hostpath_exact_JSON,url_noquery)) ) ||
+        if ( (bad_da_host_exact_flag && hasOwnPropertyDomainSuffix(bad_da_host_exact_JSON,host,!host_is_ipv4)) ||  // fastest test first
+            (bad_da_hostpath_exact_flag && hasOwnPropertyDomainSuffixPath(bad_da_hostpath_exact_JSON,host,url_pathonly,!host_is_ipv4)) ||
             // test logic: only do the slower test if the host has a (non)suspect fqdn
-            (bad_da_host_regex_flag && (bad_da_host_regex_RegExp.test(host_noserver)||bad_da_host_regex_RegExp.test(host))) ||
-            (bad_da_hostpath_regex_flag && (bad_da_hostpath_regex_RegExp.test(url_noservernoquery)||bad_da_hostpath_regex_RegExp.test(url_noquery))) ||
-            (bad_da_regex_flag && (bad_da_regex_RegExp.test(url_noserver)||bad_da_regex_RegExp.test(url_noscheme))) ||
-            (bad_url_parts_flag && bad_url_parts_RegExp.test(url)) ||
+            (bad_da_host_regex_flag && hostBucketsTest(bad_da_host_regex_Hosts,bad_da_host_regex_RegExp,host,host)) ||
+            (bad_da_hostpath_regex_flag && hostBucketsTest(bad_da_hostpath_regex_Hosts,bad_da_hostpath_regex_RegExp,host,url_noquery)) ||
+            (bad_da_regex_flag && bad_da_regex_RegExp.test(url_noscheme)) ||
+            (bad_url_parts_flag && keywordBucketsTest(bad_url_parts_Keywords,bad_url_parts_RegExp,url,url_keywords)) ||
             (bad_url_regex_flag && bad_url_regex_RegExp.test(url)) ) {
             alert_flag && alert("Blackhole: " + url + ", " + host);
             return blackhole;
@@ -1131,15 +1389,17 @@ EasyList rules:
 ||host is exact e.g. ||a.b^ ? then hasOwnProperty(hash,host)
 ||host is wildcard e.g. ||a.* ? then RegExp.test(host)
 
-||host/path is exact e.g. ||a.b/c? ? then hasOwnProperty(hash,url_path_noquery) [strip ?'s]
+||host/path is exact e.g. ||a.b/c.js ? then hasOwnProperty(hash,host) and url_path begins with a path in hash[host] [exact if ||a.b/c|]
 ||host/path is wildcard e.g. ||a.*/c? ? then RegExp.test(url_path_noquery) [strip ?'s]
 
 ||host/path?query is exact e.g. ||a.b/c?d= ? assume none [handle small number within RegExp's]
 ||host/path?query is wildcard e.g. ||a.*/c?d= ? then RegExp.test(url)
 
+host and host/path RegExp's with a literal host, e.g. ||a.b.c/d*, are bucketed by its last two labels, e.g. b.c
+
 url parts e.g. a.b^c&d|
 
-All cases RegExp.test(url)
+All cases RegExp.test(url), in buckets by a keyword of each rule, e.g. "banner" in /ads/banner^
 Except: |http://a.b. Treat these as domain anchors after stripping the scheme
 
 regex e.g. /r/
@@ -1158,21 +1418,53 @@ bad_da_host_regex == bad domain anchor with host/path type, RegExp matching
         return
 
     # Use to define js object hashes (much faster than string conversion)
-    def js_init_object(self,object_name):
+    def js_init_object(self,object_name,bloom_flag=False):
+        obj = globals()[object_name]
+        if bool(self.truncate_hash_max) and len(obj) > self.truncate_hash_max:
+            warnings.warn("Truncating regex alternatives rule set '{}' from {:d} to {:d}.".format(object_name,len(obj),self.truncate_hash_max))
+            obj = obj[:self.truncate_hash_max]
+        if self.packed_flag:
+            table = 'new PackedKeys("{}")'.format("|".join(sorted(obj)))
+        else:
+            table = '{ ' + ",\n".join('"{}": null'.format(x) for x in obj) + ' }'
+        (table, bloom_comment) = self.js_bloom_keys(table, obj) if bloom_flag else (table, '')
+        return '''\
+
+// {:d} rules{}{}:
+var {}_JSON = {};
+var {}_flag = {} > 0 ? true : false;  // test for non-zero number of rules
+'''.format(len(obj),', packed' if self.packed_flag else '',bloom_comment,object_name,table,object_name,len(obj))
+
+    def js_bloom_keys(self,table,keys):
+        """Wrap a JS table in a BloomKeys object with a Bloom filter of its keys, and describe the filter.
+Tables are left as they are without --bloom-filter or keys."""
+        if not (self.bloom_false_positive_rate > 0 and len(keys) > 0): return table, ''
+        (bits, n_bits, n_hashes) = bloom_filter(keys, self.bloom_false_positive_rate)
+        return 'new BloomKeys("{}", {:d}, {:d}, {})'.format(bits, n_bits, n_hashes, table), \
+            ', with a {:d} bit Bloom filter of {:d} hashes'.format(n_bits, n_hashes)
+
+    # host/path rules as a two level object hash: host -> array of paths, behind ObjectKeys or BloomKeys methods
+    def js_init_hostpath_object(self,object_name,bloom_flag=False):
         obj = globals()[object_name]
         if bool(self.truncate_hash_max) and len(obj) > self.truncate_hash_max:
             warnings.warn("Truncating regex alternatives rule set '{}' from {:d} to {:d}.".format(object_name,len(obj),self.truncate_hash_max))
             obj = obj[:self.truncate_hash_max]
+        host_paths = {}
+        for x in obj:
+            (host, slash, path) = x.partition('/')
+            host_paths.setdefault(host, []).append(slash + path)
+        table = '{ ' + ",\n".join('"{}": [{}]'.format(host,", ".join('"{}"'.format(path) for path in paths))
+                                  for (host, paths) in host_paths.items()) + ' }'
+        (table, bloom_comment) = self.js_bloom_keys(table, list(host_paths)) if bloom_flag else (table, '')
+        if not bloom_comment: table = 'new ObjectKeys({})'.format(table)
         return '''\
 
-// {:d} rules:
-var {}_JSON = {}{}{};
+// {:d} rules on {:d} hosts{}:
+var {}_JSON = {};
 var {}_flag = {} > 0 ? true : false;  // test for non-zero number of rules
-'''.format(len(obj),object_name,'{ ',",\n".join('"{}": null'.format(x) for x in obj),' }',object_name,len(obj))
+'''.format(len(obj),len(host_paths),bloom_comment,object_name,table,object_name,len(obj))
 
-    def js_init_regexp(self,array_name,domain_anchor=False,regex_flag=False):
-        global n_wildcard
-        n_wildcard = 1
+    def js_init_regexp(self,array_name,domain_anchor=False,regex_flag=False,bucket=None):
         domain_anchor_replace = "^(?:[\\w-]+\\.)*?" if domain_anchor else ""
         match_nothing_regexp = "/^$/"
 
@@ -1188,28 +1480,64 @@ var {}_flag = {} > 0 ? true : false;  // test for non-zero number of rules
             analysis_test = not re_test(re.compile(r'anal[iy]]',re.IGNORECASE),rule)  # LSB
             return 8*track_test + 4*beacon_test + 2*stats_test + analysis_test
         arr_star.sort(key=wildcard_preferences)
-        # Wildcard regex's use named groups. Limit their number to to an assumed maximum
-        # e.g. Python's re limit is 100
-        k_wildcard = 0
-        rule_kdx = self.wildcard_named_group_limit
-        for rule_kdx, rule in enumerate(arr_star):
-            k_wildcard += len(arr_star[rule_kdx].split('*'))-1
-            if k_wildcard > self.wildcard_named_group_limit: break
-        arr_star = arr_star[:rule_kdx]
+        # Wildcard backreference regex's use numbered groups. Limit their number to to an assumed maximum
+        # e.g. Python's re limit is 100; tempered tokens have no groups
+        if not self.tempered_flag:
+            k_wildcard = 0
+            rule_kdx = self.wildcard_named_group_limit
+            for rule_kdx, rule in enumerate(arr_star):
+                k_wildcard += len(arr_star[rule_kdx].split('*'))-1
+                if k_wildcard > self.wildcard_named_group_limit: break
+            arr_star = arr_star[:rule_kdx]
         arr = arr_nostar + arr_star
 
         if re_test(r'(?:_parts|_regex)$',array_name) and bool(self.truncate_alternatives_max) and len(arr) > self.truncate_alternatives_max:
             warnings.warn("Truncating regex alternatives rule set '{}' from {:d} to {:d}.".format(array_name,len(arr),self.truncate_alternatives_max))
             arr = arr[:self.truncate_alternatives_max]
 
-        if not regex_flag:
-            arr = [easylist_to_jsre(x) for x in arr]
+        def js_patterns(rules):
+            if regex_flag:
+                # ensure that '/' is escaped
+                return [re.sub(r'([^\\])/','\\1\/',x) for x in rules]
+            # wildcard backreferences are numbered from 1 in each RegExp
+            group_numbers = itertools.count(1)
+            return [easylist_to_jsre(x, self.tempered_flag, group_numbers) for x in rules]
+
+        # keyword buckets, as in Adblock Plus, or host buckets; rules in the buckets are left out of the RegExp
+        # with --url-parts-matching or --domain-anchor-matching regex, the buckets are empty
+        buckets = {}
+        bucket_flag = {'keyword': self.keyword_flag, 'host': self.host_flag}.get(bucket, False)
+        if bucket_flag:
+            rules = arr
+            arr = []
+            for rule in rules:
+                key = rule_keyword(rule, buckets) if bucket == 'keyword' else rule_host_key(rule)
+                if key: buckets.setdefault(key, []).append(rule)
+                else: arr.append(rule)
+            buckets = {key: js_patterns(bucket_rules) for (key, bucket_rules) in buckets.items()}
+            arr = js_patterns(arr)
+            if self.verify_regex_file and len(rules) > 0:
+                self.bucketed_regexes.append((array_name, bucket, domain_anchor_replace, "|".join(js_patterns(rules)),
+                                              {key: regex_assemble(patterns) for (key, patterns) in buckets.items()}, regex_assemble(arr)))
         else:
-            # ensure that '/' is escaped
-            arr = [re.sub(r'([^\\])/','\\1\/',x) for x in arr]
+            arr = js_patterns(arr)
 
-        arr_regexp = "/" + domain_anchor_replace + "(?:" + "|".join(arr) + ")/i"
+        arr_regexp = self.js_regexp(arr, domain_anchor_replace)
         if len(arr) == 0: arr_regexp = match_nothing_regexp
+        elif self.verify_regex_file and not bucket_flag:
+            self.assembled_regexes.append((array_name, domain_anchor_replace, "|".join(arr), regex_assemble(arr)))
+
+        if bucket:
+            n_rules = len(arr) + sum(map(len, buckets.values()))
+            return '''\
+    
+// {:d} rules in {:d} {} buckets of efficient NFA RegExp's, and {:d} rules without a {}:
+var {}_{} = {}{}{};
+var {}_RegExp = {};
+var {}_flag = {} > 0 ? true : false;  // test for non-zero number of rules
+'''.format(n_rules,len(buckets),bucket,len(arr),bucket if bucket == 'keyword' else 'literal host',array_name,
+                bucket.capitalize() + 's','{ ',",\n".join('"{}": {}'.format(key,self.js_regexp(patterns,domain_anchor_replace))
+                for (key, patterns) in buckets.items()),' }',array_name,arr_regexp,array_name,n_rules)
 
         return '''\
     
@@ -1217,6 +1545,9 @@ var {}_flag = {} > 0 ? true : false;  // test for non-zero number of rules
 var {}_RegExp = {};
 var {}_flag = {} > 0 ? true : false;  // test for non-zero number of rules
 '''.format(len(arr),array_name,arr_regexp,array_name,len(arr))
+    def js_regexp(self,arr,domain_anchor_replace=""):
+        """A JS RegExp literal matching any of the regex's in arr, factored unless --regex-assembly is flat."""
+        return "/" + domain_anchor_replace + "(?:" + ("|".join(arr) if self.regex_assembly == 'flat' else regex_assemble(arr)) + ")/i"
     # end of EasyListPAC definition
 
 # global variables and functions
@@ -1229,6 +1560,55 @@ def last_modified_resp(req):
 last_modified_to_utc = lambda lm: time.mktime(datetime.datetime.strptime(lm,"%a, %d %b %Y %X GMT").timetuple())
 file_to_utc = lambda f: time.mktime(datetime.datetime.utcfromtimestamp(os.path.getmtime(f)).timetuple())
 
+def easylist_download(url, fname_full, timeout=30., retries=3, backoff=1.):
+    """Conditionally download url to fname_full.
+
+The request carries If-Modified-Since (the local file's mtime, set to the server's Last-Modified on download)
+and If-None-Match (the ETag saved alongside the file), so an unchanged list returns 304 with no body.
+Timeouts, connection errors, 429 and 5xx responses are retried with exponential backoff; if every attempt
+fails, a previously downloaded copy is used with a warning."""
+    etag_file = fname_full + '.etag'
+    have_file = os.path.isfile(fname_full) and os.path.getsize(fname_full) > 0
+    headers = {'User-Agent': user_agent}
+    if have_file:
+        headers['If-Modified-Since'] = email.utils.formatdate(os.path.getmtime(fname_full), usegmt=True)
+        if os.path.isfile(etag_file):
+            with open(etag_file, 'r', encoding='utf-8') as fd:
+                etag = fd.read().strip()
+            if etag: headers['If-None-Match'] = etag
+    for attempt in range(retries + 1):
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout) as resp:
+                lm = last_modified_resp(resp)
+                # servers that ignore the conditional headers: keep the local file if it isn't older
+                if have_file and last_modified_to_utc(lm) <= file_to_utc(fname_full): return False
+                content = resp.read().decode('utf-8')
+                etag = resp.headers.get('ETag')
+            fname_tmp = fname_full + '.part'
+            with open(fname_tmp, mode='w', encoding='utf-8') as out_file:
+                out_file.write(content)
+            os.replace(fname_tmp, fname_full)
+            url_epoch = email.utils.parsedate_to_datetime(lm).timestamp()
+            os.utime(fname_full, (url_epoch, url_epoch))
+            if etag:
+                with open(etag_file, 'w', encoding='utf-8') as fd:
+                    fd.write(etag)
+            elif os.path.isfile(etag_file):
+                os.remove(etag_file)
+            return True
+        except urllib.error.HTTPError as e:
+            if e.code == 304: return False  # Not Modified
+            err = e
+            if (e.code < 500 and e.code != 429) or attempt == retries: break
+        except (urllib.error.URLError, OSError) as e:  # includes socket timeouts and connection resets
+            err = e
+            if attempt == retries: break
+        time.sleep(backoff * 2**attempt)
+    if have_file:
+        warnings.warn("Download of '{}' failed ({}); using '{}'.".format(url, err, fname_full))
+        return False
+    raise err
+
 user_agent = 'Mozilla/5.0 (Windows NT 10.0; WOW64; Trident/7.0; rv:11.0) like Gecko'
 
 # Monkey patch `re.sub` (***groan***)
@@ -1318,25 +1698,397 @@ hostpunct_deletepreserve_re = r'({}|\b{}\b)|({}+?)'.format(specialword_re,ipv4_r
 hostpunct_deletepreserve_reprog = re.compile(hostpunct_deletepreserve_re)
 whitespace_reprog = re.compile(r'\s+')
 whitespace_replace = ' '
+# ASCII str.translate tables equivalent to the discard classes
+punct_translations = {punct_reprog: {c: ' ' for c in range(128) if re.match(discard_class, chr(c))}
+                      for (punct_reprog, discard_class) in [(punct_deletepreserve_reprog, punct_class),
+                                                            (hostpunct_deletepreserve_reprog, hostpunct_class)]}
+
+# EasyList rule records
+# Each line is lexed exactly once into a record used by both rule parsing and the JS classification.
+# kind: 'configuration', 'selector', 'comment', 'httpempty', 'blank', or 'rule'
+# rule: the line without '@@' or options; opts, opt_tokens: the raw and tokenized options
+# anchor, category, pattern: see easylist_rule_category
+EasyListRule = collections.namedtuple('EasyListRule', ['kind', 'exception_flag', 'rule', 'opts', 'opt_tokens',
+                                                       'anchor', 'category', 'pattern'])
+httpempty_rules = frozenset(['http://', 'https://', '|http://', '|https://'])  # httpempty_re
+
+def easylist_rule_lex(line):
+    """Lex an EasyList line into an EasyListRule record in a single pass.
+Cheap string tests stand in for the configuration, selector, exception, comment and blank url regex's;
+option_re only runs on lines that contain a '$'."""
+    line_lstrip = line.lstrip()
+    if line_lstrip.startswith('[') and ']' in line_lstrip:
+        return EasyListRule('configuration', False, line, '', '', '', '', '')
+    if '#' in line: return EasyListRule('selector', False, line, '', '', '', '', '')
+    exception_flag = line.startswith('@@')
+    rule = line[2:] if exception_flag else line
+    opts = opt_tokens = ''  # default: no options in the rule
+    if '$' in rule:
+        match = option_re.match(rule)
+        if match:
+            rule, opts = match.group(1), match.group(2)
+            opt_tokens = option_tokenizer(opts)
+    if rule.lstrip().startswith('!'): kind = 'comment'
+    elif rule in httpempty_rules: kind = 'httpempty'
+    elif not rule: kind = 'blank'
+    else:
+        return EasyListRule('rule', exception_flag, rule, opts, opt_tokens, *easylist_rule_category(rule))
+    return EasyListRule(kind, exception_flag, rule, opts, opt_tokens, '', '', '')
+
+def easylist_rule_category(rule):
+    """Classify a rule (without '@@' or options) for the Javascript variables.
+
+Returns (anchor, category, pattern), where anchor is '||', '|://' (a scheme anchor) or '';
+category is the JS variable suffix, e.g. 'da_host_exact'; and pattern is the string stored in that variable.
+Rules are classified once, when they are lexed; their RuleTable keeps the category and pattern for the JS stage."""
+    # regex case
+    match = regex_re.match(rule) if rule.startswith(('/', '@')) else None
+    if match: return '', 'url_regex', match.group(1)
+    # now that regex's are handled, delete unnecessary wildcards, e.g. /.../*
+    if '*' in rule: rule = wildcard_begend_re.sub(r'\1', rule)
+    # domain anchors, || or '|http://a.b' -> domain anchor 'a.b' for regex efficiency in JS
+    anchor = ''
+    if rule.startswith('||') and len(rule) > 2:
+        anchor, rule = '||', rule[2:]
+    elif '://' in rule:
+        match = scheme_anchor_re.match(rule)
+        if match: anchor, rule = '|://', rule[match.end():]
+    if not anchor:
+        # all other non-regex patterns
+        return anchor, 'url_parts', rule
+    # host subcase
+    match = da_hostonly_re.match(rule)
+    if match:
+        rule = match.group(1)
+        return anchor, 'da_host_regex' if wild_anch_sep_exc_re.search(rule) else 'da_host_exact', rule
+    # hostpath subcase
+    match = da_hostpath_re.match(rule)
+    if match:
+        rule = match.group(1)
+        if not wild_sep_exc_noanch_re.search(rule) and pathend_re.search(rule):
+            return anchor, 'da_hostpath_exact', re.sub(r'\|$', '', rule)  # strip EOL anchors
+        return anchor, 'da_hostpath_regex', rule
+    # hostpathquery default case
+    return anchor, 'da_regex', rule
+
+# Columnar rule store
+
+# JS variable suffixes from easylist_rule_category; '' for lines that aren't rules
+rule_categories = ['', 'url_regex', 'da_host_exact', 'da_host_regex', 'da_hostpath_exact', 'da_hostpath_regex',
+                   'da_regex', 'url_parts']
+rule_category_codes = {c: k for k, c in enumerate(rule_categories)}
+
+class OrderedRuleSet:
+    """Insertion-ordered set of rules, backed by a dict for membership and a list for order.
+
+Appending a rule that is empty or already present does nothing, so the JS rule lists stay ordered and unique
+with O(1) appends, membership tests and indexing. Iteration, len and indexing behave like a list; slicing returns an OrderedRuleSet."""
+
+    def __init__(self, rules=()):
+        self.rules = {}
+        self.order = []
+        self.extend(rules)
+
+    def append(self, rule):
+        if rule and rule not in self.rules:
+            self.rules[rule] = None
+            self.order.append(rule)
+
+    def extend(self, rules):
+        for rule in rules: self.append(rule)
+
+    def __contains__(self, rule):
+        return rule in self.rules
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice): return OrderedRuleSet(self.order[index])
+        return self.order[index]
+
+class RuleTable:
+    """Columnar store of parsed EasyList rules.
+
+Rule and pattern strings are interned within the table. Option tokens and source lists are integer codes into per-table vocabularies,
+and the include flags, sources and categories are NumPy arrays; patterns are the rules' JS variable patterns. Indexing with a boolean mask or an
+index array returns a new RuleTable, so selecting and reordering rules is vectorized fancy indexing.
+Appended rows are buffered and joined to the columns on the next column access."""
+
+    column_dtypes = [('rules', object), ('opts_code', np.int32), ('include_flag', bool), ('source_code', np.int16),
+                     ('category_code', np.int8), ('patterns', object)]
+
+    def __init__(self):
+        self.columns = {name: np.empty(0, dtype=dtype) for (name, dtype) in self.column_dtypes}
+        self.opts_vocabulary = ['']  # code 0: no options
+        self.source_vocabulary = []
+        self.vocabulary_codes = {'opts': {'': 0}, 'source': {}}
+        self.pending = []
+
+    def append(self, rule, opt_tokens, include_flag, source='rules', category='', pattern=''):
+        self.pending.append((rule, self.code('opts', opt_tokens), include_flag,
+                             self.code('source', source), rule_category_codes[category], pattern))
+
+    def code(self, vocabulary_name, value):
+        codes = self.vocabulary_codes[vocabulary_name]
+        if value not in codes:
+            codes[value] = len(codes)
+            getattr(self, vocabulary_name + '_vocabulary').append(value)
+        return codes[value]
+
+    def column(self, name):
+        if self.pending:
+            rows = list(zip(*self.pending))
+            self.pending = []
+            for (k, (col, dtype)) in enumerate(self.column_dtypes):
+                new = intern_strings(rows[k]) if dtype is object else np.array(rows[k], dtype=dtype)
+                self.columns[col] = np.concatenate((self.columns[col], new))
+        return self.columns[name]
+
+    rules = property(lambda self: self.column('rules'))
+    opts_code = property(lambda self: self.column('opts_code'))
+    include_flag = property(lambda self: self.column('include_flag'))
+    source_code = property(lambda self: self.column('source_code'))
+    category_code = property(lambda self: self.column('category_code'))
+    opts = property(lambda self: np.array(self.opts_vocabulary, dtype=object)[self.opts_code])
+    sources = property(lambda self: np.array(self.source_vocabulary, dtype=object)[self.source_code])
+    patterns = property(lambda self: self.column('patterns'))
+    categories = property(lambda self: np.array(rule_categories, dtype=object)[self.category_code])
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __getitem__(self, index):
+        """Rows selected by a boolean mask or an index array."""
+        table = RuleTable()
+        table.opts_vocabulary = list(self.opts_vocabulary)
+        table.source_vocabulary = list(self.source_vocabulary)
+        table.vocabulary_codes = {name: dict(codes) for (name, codes) in self.vocabulary_codes.items()}
+        table.columns = {name: self.column(name)[index] for (name, _) in self.column_dtypes}
+        return table
+
+    def to_arrays(self, prefix=''):
+        """Arrays for np.savez; see string_arrays."""
+        arrays = {prefix + name: self.column(name) for (name, dtype) in self.column_dtypes if dtype is not object}
+        for (name, strings) in [('rules', self.rules), ('patterns', self.patterns), ('opts_vocabulary', self.opts_vocabulary),
+                                ('source_vocabulary', self.source_vocabulary)]:
+            arrays.update(string_arrays(prefix + name, strings))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix=''):
+        strings = lambda name: arrays_strings(arrays, prefix + name)
+        table = cls()
+        table.opts_vocabulary = strings('opts_vocabulary')
+        table.source_vocabulary = strings('source_vocabulary')
+        table.vocabulary_codes = {name: {value: k for (k, value) in enumerate(getattr(table, name + '_vocabulary'))}
+                                  for name in ['opts', 'source']}
+        table.columns = {name: arrays[prefix + name] for (name, dtype) in cls.column_dtypes if dtype is not object}
+        table.columns['rules'] = intern_strings(strings('rules'))
+        table.columns['patterns'] = intern_strings(strings('patterns'))
+        return table
+
+    @classmethod
+    def concatenate(cls, tables):
+        """Concatenate tables in order, merging their vocabularies."""
+        res = cls()
+        columns = {name: [] for (name, _) in cls.column_dtypes}
+        for table in tables:
+            opts_recode = np.array([res.code('opts', value) for value in table.opts_vocabulary], dtype=np.int32)
+            source_recode = np.array([res.code('source', value) for value in table.source_vocabulary], dtype=np.int16)
+            columns['rules'].append(table.rules)
+            columns['opts_code'].append(opts_recode[table.opts_code])
+            columns['include_flag'].append(table.include_flag)
+            columns['source_code'].append(source_recode[table.source_code])
+            columns['category_code'].append(table.category_code)
+            columns['patterns'].append(table.patterns)
+        if tables: res.columns = {name: np.concatenate(columns[name]) for (name, _) in cls.column_dtypes}
+        res.columns['rules'] = intern_strings(res.columns['rules'])  # share duplicate rules across lists
+        res.columns['patterns'] = intern_strings(res.columns['patterns'])
+        return res
+
+class EasyListParser:
+    """Rule parsing state: good and bad RuleTables, rule counts by source and reason, and the comment section state.
+The same parser parses whole lists in the main process and chunks of lines in worker processes."""
+
+    # reasons returned by easylist_append_one_rule; all but the first are skipped or excluded
+    rule_reasons = ['added', 'configuration', 'selector', 'comment', 'ignored_section', 'httpempty', 'blank',
+                    'exception', 'option']
+
+    def __init__(self, exceptions_include_flag=False, debug=False, print_sections_flag=True,
+                 good_table=None, bad_table=None, rule_counts=None):
+        self.exceptions_include_flag = exceptions_include_flag
+        self.debug = debug
+        # print the ignored comment sections as they are parsed; chunks parsed in worker processes only count them
+        self.print_sections_flag = print_sections_flag
+        self.good_table = RuleTable() if good_table is None else good_table
+        self.bad_table = RuleTable() if bad_table is None else bad_table
+        self.rule_counts = collections.Counter() if rule_counts is None else rule_counts
+        self.ignore_rules_flag = False
+        self.ignored_rules_count = 0
+
+    def easylist_append_rules(self, fd, source='rules', ignore_rules_flag=False):
+        """Append EasyList rules from file to good and bad lists. Count the rules by source and reason.
+ignore_rules_flag is the comment-section state at the first line, for files parsed in chunks."""
+        # comment sections to ignore extend until the next non-ignorable comment
+        self.ignore_rules_flag = ignore_rules_flag
+        self.ignored_rules_count = 0
+        for line in fd:
+            line = line.rstrip()
+            reason = self.easylist_append_one_rule(line, source)
+            self.rule_counts[source, reason] += 1
+            if self.debug and reason != 'added': print("Rule '{}' not added: {}.".format(line, reason), flush=True)
+        if self.ignore_rules_flag and self.print_sections_flag:
+            print('\n {:d} rules ignored.'.format(self.ignored_rules_count), flush=True)
+
+    def easylist_append_one_rule(self, line, source='rules'):
+        """Append EasyList rules from line to good and bad lists. Return the reason in rule_reasons."""
+        record = easylist_rule_lex(line)
+        # configuration lines and selector rules should already be filtered out
+        if record.kind == 'configuration' or record.kind == 'selector': return record.kind
+        # comment case: ignore
+        if record.kind == 'comment':
+            if commentname_sections_ignore_reprog().search(record.rule):
+                ignored_rules_comment_start = comment_re.sub('', record.rule)
+                if not self.ignore_rules_flag:
+                    self.ignored_rules_count = 0
+                    self.ignore_rules_flag = True
+                    if self.print_sections_flag: print('Ignore rules following comment ', end='', flush=True)
+                if self.print_sections_flag: print('"{}"… '.format(ignored_rules_comment_start), end='', flush=True)
+            else:
+                if self.ignore_rules_flag and self.print_sections_flag:
+                    print('\n {:d} rules ignored.'.format(self.ignored_rules_count), flush=True)
+                self.ignored_rules_count = 0
+                self.ignore_rules_flag = False
+            return 'comment'
+        if self.ignore_rules_flag:
+            self.ignored_rules_count += 1
+            self.append_rule(record.exception_flag, record.rule, record.opt_tokens, False, source, record.category,
+                             record.pattern)
+            return 'ignored_section'
+        # blank url case and blank line case: ignore
+        if record.kind == 'httpempty' or record.kind == 'blank': return record.kind
+        # block default or pass exception
+        if record.exception_flag and not self.exceptions_include_flag:
+            self.append_rule(record.exception_flag, record.rule, record.opt_tokens, False, source, record.category,
+                             record.pattern)
+            return 'exception'
+        # specific options: ignore
+        # too many rules (>~ 10k) bog down the browser; make reasonable exclusions here
+        if re_test(not3dimppuposgh_option_exception_re, record.opts):
+            self.append_rule(record.exception_flag, record.rule, record.opt_tokens, False, source, record.category,
+                             record.pattern)
+            return 'option'
+        # add all remaining rules
+        self.append_rule(record.exception_flag, record.rule, record.opt_tokens, True, source, record.category, record.pattern)
+        return 'added'
+
+    def append_rule(self,exception_flag,rule, opt_tokens, include_rule_flag, source='rules', category='', pattern=''):
+        if not bool(rule): return  # last chance to reject blank lines -- shouldn't happen
+        table = self.good_table if exception_flag else self.bad_table
+        table.append(rule, opt_tokens, include_rule_flag, source, category, pattern)
+
+def easylist_parser_version(exceptions_include_flag):
+    """Fingerprint of everything that determines parsed rules: the parsing code, its regex's and options.
+Parsed-rule caches written by another parser version are ignored."""
+    parser_regexes = [option_re, comment_re, not3dimppuposgh_option_exception_re, easylist_name_opts_re, regex_re,
+                      wildcard_begend_re, scheme_anchor_re, da_hostonly_re, da_hostpath_re, wild_anch_sep_exc_re,
+                      wild_sep_exc_noanch_re, pathend_re]
+    parser_code = [easylist_rule_lex, easylist_rule_category, option_tokenizer, RuleTable,
+                   EasyListParser]
+    fingerprint = '\n'.join([repr(exceptions_include_flag), commentname_sections_ignore_re]
+                             + ['{}/{:d}'.format(regex.pattern, regex.flags) for regex in parser_regexes]
+                             + rule_categories + EasyListParser.rule_reasons + [inspect.getsource(code) for code in parser_code])
+    return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:16]
+
+def easylist_parse_chunk(lines, source, exceptions_include_flag, debug=False, ignore_rules_flag=False):
+    """Parse a chunk of EasyList lines, e.g. in a worker process.
+Returns the chunk's good and bad RuleTables and its rule counts."""
+    parser = EasyListParser(exceptions_include_flag, debug, print_sections_flag=False)
+    parser.easylist_append_rules(lines, source, ignore_rules_flag)
+    return parser.good_table, parser.bad_table, parser.rule_counts
+
+def easylist_chunks(lines, chunk_size):
+    """Split lines into chunks, each with the comment-section ignore state at its first line.
+Only comment lines change that state, so lines without a '!' are skipped by the scan."""
+    ignore_rules_flag = False
+    for start in range(0, len(lines), chunk_size):
+        chunk = lines[start:start + chunk_size]
+        yield chunk, ignore_rules_flag
+        for line in chunk:
+            if '!' not in line: continue
+            record = easylist_rule_lex(line.rstrip())
+            if record.kind == 'comment': ignore_rules_flag = bool(commentname_sections_ignore_reprog().search(record.rule))
+
+def string_arrays(name, strings):
+    """Arrays for np.savez holding strings '\\n'-joined as UTF-8 bytes, so loading needs no pickle."""
+    return {name: np.frombuffer('\n'.join(strings).encode('utf-8'), dtype=np.uint8), name + '_length': np.array(len(strings))}
+
+def arrays_strings(arrays, name):
+    if int(arrays[name + '_length']) == 0: return []
+    return arrays[name].tobytes().decode('utf-8').split('\n')
+
+def intern_strings(strings):
+    """Object array of strings in which equal strings are the same object.
+Unlike sys.intern, the lookup table is dropped once the array is built."""
+    interned = {}
+    res = np.empty(len(strings), dtype=object)
+    res[:] = [interned.setdefault(x, x) for x in strings]
+    return res
+
+# exact rule categories are limited to those in badregex_regex_filters_re, as are all bad rules except these
+filtered_exact_categories = frozenset(['da_host_exact', 'da_hostpath_exact'])
+unfiltered_bad_categories = frozenset(['da_regex'])
+
+# rule evaluation cost model for budget selection, in regex alternatives tested per URL
+# exact categories are hash lookups whose cost doesn't grow with their size; regex's are tested once per URL,
+# except rules in keyword or host buckets, which are tested only on URLs with their keyword or host
+category_url_tests = {'da_host_exact': 0, 'da_hostpath_exact': 0, 'da_host_regex': 1, 'da_hostpath_regex': 1, 'da_regex': 1,
+                      'url_parts': 1, 'url_regex': 1}
+bucket_url_tests = 0.1  # assumed fraction of URLs that hit a rule's bucket
+wildcard_cost = 2.  # each wildcard's lookahead scan, per test
+
+def rule_cost(js_var_name, pattern, tempered_flag=False, keyword_flag=False, host_flag=False, packed_flag=False):
+    """Estimated evaluation cost and size in bytes of a pattern in the JS variable js_var_name.
+keyword_flag, host_flag: url_parts rules are in keyword buckets, and domain anchored host and host/path regex rules
+in host buckets, as with --url-parts-matching keyword and --domain-anchor-matching host.
+packed_flag: exact host tables are packed strings, as with --hash-encoding packed."""
+    category = js_var_name.split('_', 1)[1]
+    if category == 'da_host_exact' and packed_flag: return 0., len(pattern) + len('|')
+    if category.endswith('_exact'): return 0., len(pattern) + len('"": null,\n')
+    if keyword_flag and category == 'url_parts' and rule_keyword(pattern, {}): url_tests = bucket_url_tests
+    elif host_flag and category in ('da_host_regex', 'da_hostpath_regex') and rule_host_key(pattern): url_tests = bucket_url_tests
+    else: url_tests = category_url_tests[category]
+    cost = url_tests*(1. + wildcard_cost*pattern.count('*'))
+    size = len(pattern if category == 'url_regex' else easylist_to_jsre(pattern, tempered_flag)) + len('|')
+    return cost, size
 
 def exception_filter(line):
     return bool(exception_re.search(line))
 def line_hostpath_rule(line):
-   line = exception_re.sub(r'\1',line)
-   line = domain_anch_re.sub(r'\1',line)
-   line = option_re.sub(r'\1',line)
+   if line.startswith('@@'): line = exception_re.sub(r'\1',line)
+   if line.startswith('||'): line = domain_anch_re.sub(r'\1',line)
+   if '$' in line: line = option_re.sub(r'\1',line)
    return line
 def punct_delete(line,punct_re=punct_deletepreserve_reprog):
-    res = line
-    res = re_sub(punct_re,punct_deletepreserve_replace,res)
-    res = re_sub(whitespace_reprog,whitespace_replace,res)
+    # with no special word or IPv4 address to preserve, all punctuation becomes whitespace
+    if punct_re in punct_translations and line.isascii() and '<' not in line and not ipv4_re.search(line):
+        res = line.translate(punct_translations[punct_re])
+    else:
+        res = re_sub(punct_re,punct_deletepreserve_replace,line)
+    res = whitespace_reprog.sub(whitespace_replace,res)
     return res
 def rule_tokenizer(rule):
     rule = line_hostpath_rule(rule)
-    host_part = re_sub(host_path_parts_re,r'\1',rule)
-    path_part = re_sub(host_path_parts_re,r'\2',rule)
+    # host_path_parts_re always matches at the start; both substitutions keep the unmatched remainder
+    parts = host_path_parts_re.match(rule)
+    host_part = (parts.group(1) or '') + rule[parts.end():]
+    path_part = (parts.group(2) or '') + rule[parts.end():]
     toks = ' '.join([punct_delete(host_part,punct_re=hostpunct_deletepreserve_reprog), punct_delete(path_part)]).strip()
-    toks = re_sub(whitespace_reprog,whitespace_replace,toks)
+    toks = whitespace_reprog.sub(whitespace_replace,toks)
     return toks
 easylist_name_opts_re = re.compile(r'^~?\b(third\-party|domain|script|image|stylesheet|object(?!-subrequest)|object\-subrequest|xmlhttprequest|subdocument|ping|websocket|webrtc|document|elemhide|generichide|genericblock|other|sitekey|match-case|collapse|donottrack|popup|media|font)(?:=.+?)?$')
 def option_tokenizer(opts):
@@ -1354,62 +2106,280 @@ def re_test(regex,string):
     if isinstance(regex,str): regex = re.compile(regex)
     return bool(regex.search(string))
 
+class LiteralIndex:
+    """Aho-Corasick automaton: whether a string contains any of a set of literals, in time linear in the string's length."""
+
+    def __init__(self, literals):
+        # trie of the literals, then failure links in breadth-first order
+        self.goto = [{}]
+        self.out = [False]
+        for literal in literals:
+            state = 0
+            for c in literal:
+                if c not in self.goto[state]:
+                    self.goto.append({})
+                    self.out.append(False)
+                    self.goto[state][c] = len(self.goto) - 1
+                state = self.goto[state][c]
+            self.out[state] = True
+        self.fail = [0]*len(self.goto)
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for (c, next_state) in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and c not in self.goto[fail]: fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(c, 0)
+                self.out[next_state] = self.out[next_state] or self.out[self.fail[next_state]]
+
+    def search(self, string):
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for c in string:
+            while state and c not in goto[state]: state = fail[state]
+            state = goto[state].get(c, 0)
+            if out[state]: return True
+        return False
+
+@fnt.lru_cache(maxsize=None)
+def badregex_filter_test(string):
+    """Whether string matches badregex_regex_filters_re, using its literal index and the regex remainder.
+Results are cached, so each rule or pattern is tested once."""
+    literals, remainder = badregex_filters_index()
+    return literals.search(string.lower()) or bool(remainder.search(string))
+
 # Logistic Regression functions
 
-# feature vector hashes
-# JSON structure: {"token": { "column": list of int, "count": list of int, "row_index": int }
-# create adjacency lists for memory efficient sparse COO array construction
-
-default_row = {"column": [], "count": []}
-def feature_vector_append_column(rule,opts,col,feature_vector={}):
-    # rule grams
-    toks = re.split(r'\s+',rule_tokenizer(rule))
-    for k in range(len(toks)):
-        # 1- and 2-grams
-        grams = [toks[k], toks[k] + ' ' + toks[k + 1]] if k < len(toks) - 1 else [toks[k]]
-        feature_vector_append_grams(grams, col, feature_vector, weight=1/np.sqrt(len(toks)))
-    if bool(opts):
-        # option tokens (1-grams)
-        grams = ['option: ' + x for x in re.split(r'\s+', option_tokenizer(opts))]
-        feature_vector_append_grams(grams, col, feature_vector, weight=min(0.5, 1.e-1/np.sqrt(len(grams))))
-    if len(toks) <= 3:
-        """Add information from available options and high weight regex matches."""
-        # regex tokens used to relate for short, unique rules
+# feature vectors: token 1- and 2-grams, option tokens, and high weight regex's for short rules
+def rule_feature_matrix(table, vocabulary=None):
+    """Compute the sparse, transposed, CSR feature matrix and row hash of a RuleTable's rules.
+
+Each distinct gram is assigned a feature id in order of first appearance, after those of an existing vocabulary
+(which is extended). Rule, feature id and weight triplets are collected in flat arrays, and grams repeated within
+a rule are summed when the CSR matrix is built."""
+    rules = table.rules
+    rule_toks = [re.split(r'\s+', rule_tokenizer(rule)) for rule in rules]
+    # regex tokens used to relate for short, unique rules
+    short_columns = [col for (col, toks) in enumerate(rule_toks) if len(toks) <= 3]
+    short_regex_matches = dict(zip(short_columns, high_weight_regex_counts([rules[col] for col in short_columns]) > 0))
+    if vocabulary is None: vocabulary = {}
+    feature_ids = []
+    weights = []
+    row_lengths = np.zeros(len(table), dtype=np.int64)
+    # option grams are computed once per distinct option string
+    opts_grams = {}
+    for col, (toks, opts_code) in enumerate(zip(rule_toks, table.opts_code)):
+        n_features = len(feature_ids)
+        # rule grams
         grams = []
-        for regex in high_weight_regex:
-            if bool(regex.search(rule)): grams.append('regex: ' + regex.pattern)
-        if bool(grams): feature_vector_append_grams(grams, col, feature_vector, weight=1/np.sqrt(len(grams)))
-
-def feature_vector_append_grams(grams, col, feature_vector={}, weight=1.):
-    for ky in grams:
-        feature_vector[ky] = feature_vector.get(ky, copy.deepcopy(default_row))
-        if not feature_vector[ky]["column"] or feature_vector[ky]["column"][-1] is not col:
-            feature_vector[ky]["column"].append(col)
-            feature_vector[ky]["count"].append(0)
-        feature_vector[ky]["count"][-1] += weight
-
-# store feature vectors as sparse arrays
-def fv_to_mat(feature_vector=copy.deepcopy(default_row),rules=[]):
-    """Compute sparse, transposed, CSR matrix and row hash from a feature vector."""
-    row_hash = {}
-    rows = []
-    cols = []
-    vals = []
-    for i, tok in enumerate(feature_vector):
-        feature_vector[tok]["row_index"] = i
-        row_hash[i] = tok
-        j_new = feature_vector[tok]["column"]
-        i_new = [i]*len(j_new)
-        v_new = feature_vector[tok]["count"]
-        rows += i_new
-        cols += j_new
-        vals += v_new
-    fv_mat = sps.coo_matrix((vals,(cols,rows)),shape=(len(rules),len(feature_vector)),dtype=np.float).tocsr()
+        for k in range(len(toks) - 1): grams += [toks[k], toks[k] + ' ' + toks[k + 1]]
+        grams.append(toks[-1])
+        feature_ids += [vocabulary.setdefault(gram, len(vocabulary)) for gram in grams]
+        weights += [1/np.sqrt(len(toks))]*len(grams)
+        if opts_code > 0:
+            # option tokens (1-grams)
+            if opts_code not in opts_grams:
+                opts_grams[opts_code] = ['option: ' + x for x in re.split(r'\s+', option_tokenizer(table.opts_vocabulary[opts_code]))]
+            grams = opts_grams[opts_code]
+            feature_ids += [vocabulary.setdefault(gram, len(vocabulary)) for gram in grams]
+            weights += [min(0.5, 1.e-1/np.sqrt(len(grams)))]*len(grams)
+        if col in short_regex_matches and short_regex_matches[col].any():
+            grams = [high_weight_regex_grams[k] for k in np.flatnonzero(short_regex_matches[col])]
+            feature_ids += [vocabulary.setdefault(gram, len(vocabulary)) for gram in grams]
+            weights += [1/np.sqrt(len(grams))]*len(grams)
+        row_lengths[col] = len(feature_ids) - n_features
+    rows = np.repeat(np.arange(len(table)), row_lengths)
+    fv_mat = sps.csr_matrix((np.array(weights, dtype=float), (rows, np.array(feature_ids, dtype=np.int64))),
+                            shape=(len(table), len(vocabulary)))
+    row_hash = list(vocabulary)
     return fv_mat, row_hash
 
+def high_weight_regex_counts(rules):
+    """Array of the number of (non-overlapping) high_weight_regex matches, one row per rule.
+
+Each regex is run once over the newline-joined rules; no regex matches across a newline."""
+    counts = np.zeros((len(rules), len(high_weight_regex)), dtype=int)
+    if len(rules) == 0: return counts
+    text = '\n'.join(rules)
+    rule_starts = np.cumsum([0] + [len(rule) + 1 for rule in rules[:-1]])
+    for k, pattern in enumerate(high_weight_regex):
+        positions = [m.start() for m in re.finditer(pattern, text, re.IGNORECASE | re.MULTILINE)]
+        counts[:, k] = np.bincount(np.searchsorted(rule_starts, positions, side='right') - 1, minlength=len(rules))
+    return counts
+
+def logreg_state_version(C):
+    """Fingerprint of everything that determines a rule's features, label, weight and sliding window signal.
+Logistic regression states saved by another version are ignored."""
+    logreg_regexes = [re.compile(pattern, re.IGNORECASE) for pattern in high_weight_regex] + [re.compile(badregex_regex_filters_re, re.IGNORECASE), thrdp_im_pup_os_option_re, not3dimppupos_option_exception_re,
+                                          exception_re, domain_anch_re, option_re, host_path_parts_re, easylist_name_opts_re,
+                                          punct_deletepreserve_reprog, hostpunct_deletepreserve_reprog, whitespace_reprog]
+    logreg_code = [rule_feature_matrix, high_weight_regex_counts, line_hostpath_rule, punct_delete, rule_tokenizer, option_tokenizer,
+                   badregex_filter_test, badregex_filters_index, LiteralIndex, EasyListPAC.good_class_test, EasyListPAC.bad_class_test, EasyListPAC.logit_fit_method_sample_weights,
+                   EasyListPAC.logreg_test_in_training, compact_training_rows, NumpyLogisticRegression, logreg_loo_decision_function, sliding_window_refit]
+    fingerprint = '\n'.join([repr(C)] + ['{}/{:d}'.format(regex.pattern, regex.flags) for regex in logreg_regexes]
+                            + [inspect.getsource(code) for code in logreg_code])
+    return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:16]
+
+class NumpyLogisticRegression:
+    """L2-regularized logistic regression with the objective of scikit-learn's liblinear solver, including its
+regularized intercept, fit by L-BFGS. Loss and gradient are accumulated over row blocks of X, so the temporaries
+stay bounded. Provides the parts of LogisticRegression used here."""
+
+    def __init__(self, C=1.0, tol=1.e-4, max_iter=200, chunk_size=1 << 16, warm_start=False):
+        self.C = C
+        self.tol = tol
+        self.max_iter = max_iter
+        self.chunk_size = chunk_size
+        self.warm_start = warm_start
+        self.intercept_scaling = 1.
+
+    def loss_gradient(self, theta, X, y, w):
+        loss = theta @ theta/2.
+        grad = theta.copy()
+        coef, intercept = theta[:-1], self.intercept_scaling*theta[-1]
+        for k in range(0, X.shape[0], self.chunk_size):
+            X_chunk = X if X.shape[0] <= self.chunk_size else X[k:k + self.chunk_size]
+            y_chunk, w_chunk = y[k:k + self.chunk_size], w[k:k + self.chunk_size]
+            eta = X_chunk @ coef + intercept
+            loss += self.C*(w_chunk @ (np.logaddexp(0., eta) - y_chunk*eta))
+            residual = self.C*w_chunk*(np.exp(-np.logaddexp(0., -eta)) - y_chunk)
+            grad[:-1] += X_chunk.T @ residual
+            grad[-1] += self.intercept_scaling*residual.sum()
+        return loss, grad
+
+    def fit(self, X, y, sample_weight=None):
+        X = sps.csr_matrix(X)
+        w = np.ones(X.shape[0]) if sample_weight is None else np.asarray(sample_weight, dtype=float)
+        if self.warm_start and hasattr(self, 'coef_'):
+            theta = np.append(self.coef_.ravel(), self.intercept_/self.intercept_scaling)
+        else:
+            theta = np.zeros(X.shape[1] + 1)
+        res = spo.minimize(self.loss_gradient, theta, args=(X, np.asarray(y, dtype=float), w), method='L-BFGS-B', jac=True,
+                           options={'maxiter': self.max_iter, 'gtol': self.tol})
+        self.coef_ = res.x[np.newaxis, :-1]
+        self.intercept_ = np.array([self.intercept_scaling*res.x[-1]])
+        return self
+
+    def decision_function(self, X):
+        return X @ self.coef_.ravel() + self.intercept_[0]
+
+def standard_scale_columns(X):
+    """Scale each column of a sparse matrix by its standard deviation, as StandardScaler(with_mean=False) does."""
+    X = sps.csr_matrix(X, dtype=float)
+    mean = np.asarray(X.mean(axis=0)).ravel()
+    scale = np.sqrt(np.maximum(np.asarray(X.multiply(X).mean(axis=0)).ravel() - mean**2, 0.))
+    scale[scale < 10.*np.finfo(float).eps] = 1.
+    return (X @ sps.diags(1./scale)).tocsr()
+
+def logreg_loo_decision_function(fv_logreg, X_all, y_all, w_all, columns, w_test=None):
+    """Approximate leave-one-out decision function values of the rows X_all[columns].
+
+Each value is a Newton step from the full-data fit to the fit with that row left out. liblinear minimizes
+    f(theta) = theta'theta/2 + C sum_j w_j log(1 + exp(-y_j x_j'theta))
+with x_j augmented by intercept_scaling, because it regularizes the intercept too. With eta = X theta, p = sigmoid(eta),
+a = C w p (1 - p), Hessian H = I + X' diag(a) X, and gradient g (nonzero within the fit's tolerance), leaving out row i gives
+    eta_-i = eta_i - (x_i'H^-1 g - C w_i (p_i - y_i) h_i) / (1 - a_i h_i),    h_i = x_i'H^-1 x_i
+by the Sherman-Morrison formula. H^-1 g is a single conjugate gradient solve. h_i uses the block of H on row i's own
+features, neglecting their coupling through the features row i doesn't have. With weights w_test, only that much
+of each row's sample weight is left out, as for one of the rules merged by compact_training_rows."""
+    if len(columns) == 0: return np.zeros(0)
+    Xa = sps.hstack([X_all, fv_logreg.intercept_scaling*np.ones((X_all.shape[0], 1))]).tocsr()
+    theta = np.append(fv_logreg.coef_.ravel(), fv_logreg.intercept_/fv_logreg.intercept_scaling)
+    eta = Xa @ theta
+    p = np.exp(-np.logaddexp(0., -eta))
+    a = fv_logreg.C*w_all*p*(1. - p)
+    c = fv_logreg.C*w_all*(p - y_all)
+    H = (sps.identity(Xa.shape[1], format='csr') + Xa.T @ sps.diags(a) @ Xa).tocsr()
+    H_inv_g, _ = spsl.cg(H, theta + Xa.T @ c, M=sps.diags(1./H.diagonal()), maxiter=10*Xa.shape[1])
+    X_test = Xa[columns]
+    h = np.zeros(len(columns))
+    # batch the block solves by the number of features in each row
+    row_nnz = np.diff(X_test.indptr)
+    groups = []
+    for n_features in np.unique(row_nnz):
+        rows = np.flatnonzero(row_nnz == n_features)
+        nz = X_test.indptr[rows][:, np.newaxis] + np.arange(n_features)
+        groups.append((rows, X_test.indices[nz], X_test.data[nz]))
+    # look up all blocks at once; sparse element lookup is much faster in bulk
+    H_blocks = np.asarray(H[np.concatenate([np.repeat(features, features.shape[1], axis=1).ravel() for (_, features, _) in groups]),
+                            np.concatenate([np.tile(features, (1, features.shape[1])).ravel() for (_, features, _) in groups])]).ravel()
+    offset = 0
+    for (rows, features, x) in groups:
+        H_block = H_blocks[offset:offset + features.size*features.shape[1]].reshape(len(rows), features.shape[1], features.shape[1])
+        offset += features.size*features.shape[1]
+        h[rows] = np.einsum('ij,ij->i', x, np.linalg.solve(H_block, x[:, :, np.newaxis])[:, :, 0])
+    if w_test is None: w_test = w_all[columns]
+    a_test = fv_logreg.C*w_test*p[columns]*(1. - p[columns])
+    c_test = fv_logreg.C*w_test*(p[columns] - y_all[columns])
+    return eta[columns] - (X_test @ H_inv_g - c_test*h)/(1. - a_test*h)
+
+def compact_training_rows(X, y, w):
+    """Merge rows with identical features and label into one sample with their total weight.
+The logistic regression objective is unchanged. Returns the compacted X, y and w, and each row's sample index."""
+    X = X.tocsr()
+    if not X.has_sorted_indices: X = X.sorted_indices()
+    sample_index = {}
+    samples = np.array([sample_index.setdefault((y[k], X.indices[X.indptr[k]:X.indptr[k + 1]].tobytes(),
+                                                  X.data[X.indptr[k]:X.indptr[k + 1]].tobytes()), len(sample_index))
+                        for k in range(X.shape[0])], dtype=np.int64)
+    _, first_rows = np.unique(samples, return_index=True)
+    return X[first_rows], y[first_rows], np.bincount(samples, weights=w, minlength=len(sample_index)), samples
+
+# sliding window refits in a worker pool sharing the training data
+def csr_arrays(X, y, w):
+    X = X.tocsr()
+    return {'data': X.data, 'indices': X.indices, 'indptr': X.indptr, 'shape': np.array(X.shape), 'y': y, 'w': w}
+
+def shared_memory_arrays(arrays):
+    """Copy arrays into shared memory; return the SharedMemory blocks and a picklable spec for shared_memory_attach."""
+    blocks = {}
+    spec = {}
+    for (key, array) in arrays.items():
+        array = np.ascontiguousarray(array)
+        blocks[key] = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=blocks[key].buf)[...] = array
+        spec[key] = (blocks[key].name, array.shape, array.dtype.str)
+    return blocks, spec
+
+def shared_memory_attach(spec):
+    blocks = {key: shared_memory.SharedMemory(name=name) for (key, (name, _, _)) in spec.items()}
+    arrays = {key: np.ndarray(shape, dtype=dtype, buffer=blocks[key].buf) for (key, (_, shape, dtype)) in spec.items()}
+    return blocks, arrays
+
+sliding_window_worker_state = {}
+
+def sliding_window_worker_init(shared_spec, fv_logregs):
+    """Attach a worker to the shared training data; views are used, so nothing is copied."""
+    machine_learning_import()
+    blocks, arrays = shared_memory_attach(shared_spec)
+    sliding_window_worker_state['blocks'] = blocks  # keep the shared memory mapped
+    for (name, fv_logreg) in fv_logregs.items():
+        X = sps.csr_matrix((arrays[name + '_data'], arrays[name + '_indices'], arrays[name + '_indptr']),
+                           shape=tuple(arrays[name + '_shape']), copy=False)
+        sliding_window_worker_state[name] = (X, arrays[name + '_y'], arrays[name + '_w'], fv_logreg)
+
+def sliding_window_refit(name, rows, weights):
+    """Leave-one-out decision function values of the rows X[rows].
+
+Each rule is left out by subtracting its weight from its row's sample weight, which removes it from the objective
+without copying X; the worker's estimator is warm-started from its previous fit."""
+    X, y, w, fv_logreg = sliding_window_worker_state[name]
+    w_loo = np.array(w)
+    res = np.zeros(len(rows))
+    for (k, (row, weight)) in enumerate(zip(rows, weights)):
+        w_loo[row] = max(0., w[row] - weight)
+        fv_logreg.fit(X, y, sample_weight=w_loo)
+        res[k] = fv_logreg.decision_function(X[row])[0]
+        w_loo[row] = w[row]
+    return res
+
 # convert EasyList wildcard '*', separator '^', and anchor '|' to regexp; ignore '?' globbing
 # http://blogs.perl.org/users/mauke/2017/05/converting-glob-patterns-to-efficient-regexes-in-perl-and-javascript.html
 # For efficiency this these are converted in Python; observed to be important in iSO kernel
+# A wildcard followed by X matches up to the first X. The lookahead backreference (?=([\s\S]*?X))\N makes this atomic,
+# at the cost of one numbered group per wildcard across the whole alternation. The tempered token (?:(?!X)[\s\S])*X
+# matches the same strings without groups: it can't step past an X, so backtracking never tries a later one.
 
 # var domain_anchor_RegExp = RegExp("^\\\\|\\\\|");
 # // performance: use a simplified, less inclusive of subdomains, regex for domain anchors
@@ -1458,8 +2428,10 @@ def fv_to_mat(feature_vector=copy.deepcopy(default_row),rules=[]):
 #     return pat;
 # }
 
-n_wildcard = 1
-def easylist_to_jsre(pat):
+def easylist_to_jsre(pat, tempered_flag=False, group_numbers=None):
+    """A JS regex for an EasyList pattern. Wildcard backreferences are numbered from group_numbers, an iterator shared
+by the patterns of one RegExp, or from 1."""
+    if group_numbers is None: group_numbers = itertools.count(1)
     def re_easylist(match):
         mg = match.group()[0]
         # https://adblockplus.org/filters#regexps, separator "^" == [^\\w.%-]
@@ -1473,12 +2445,13 @@ def easylist_to_jsre(pat):
     def tr(pat):
         return re.sub(r'[][\-/.?:!+^|$(){}]', re_easylist, pat)
     def re_wildcard(match):
-        global n_wildcard
         mg = match.group()
         if mg[0] != "*": return tr(mg)
-        res = '(?=([\\s\\S]*?' + tr(mg[1:]) + '))\\' + '{:d}'.format(n_wildcard)
-        n_wildcard += 1
-        return res
+        if tempered_flag:
+            # a trailing wildcard matches anything, including nothing
+            if len(mg) == 1: return ''
+            return '(?:(?!' + tr(mg[1:]) + ')[\\s\\S])*' + tr(mg[1:])
+        return '(?=([\\s\\S]*?' + tr(mg[1:]) + '))\\' + '{:d}'.format(next(group_numbers))
     domain_anchor_replace = "^(?:[\\w-]+\\.)*?"
     bos = ''
     if re_test(domain_anch_re,pat):
@@ -1487,223 +2460,305 @@ def easylist_to_jsre(pat):
     pat = bos + re.sub(r'(\W[^*]*)', re_wildcard, pat)
     return pat
 
-def ordered_unique_all_js_var_lists():
-    global good_da_host_exact
-    global good_da_host_regex
-    global good_da_hostpath_exact
-    global good_da_hostpath_regex
-    global good_da_regex
-    global good_da_host_exceptions_exact
-
-    global bad_da_host_exact
-    global bad_da_host_regex
-    global bad_da_hostpath_exact
-    global bad_da_hostpath_regex
-    global bad_da_regex
-
-    global good_url_parts
-    global bad_url_parts
-    global good_url_regex
-    global bad_url_regex
-
-    good_da_host_exact = ordered_unique_nonempty(good_da_host_exact)
-    good_da_host_regex = ordered_unique_nonempty(good_da_host_regex)
-    good_da_hostpath_exact = ordered_unique_nonempty(good_da_hostpath_exact)
-    good_da_hostpath_regex = ordered_unique_nonempty(good_da_hostpath_regex)
-    good_da_regex = ordered_unique_nonempty(good_da_regex)
-    good_da_host_exceptions_exact = ordered_unique_nonempty(good_da_host_exceptions_exact)
-
-    bad_da_host_exact = ordered_unique_nonempty(bad_da_host_exact)
-    bad_da_host_regex = ordered_unique_nonempty(bad_da_host_regex)
-    bad_da_hostpath_exact = ordered_unique_nonempty(bad_da_hostpath_exact)
-    bad_da_hostpath_regex = ordered_unique_nonempty(bad_da_hostpath_regex)
-    bad_da_regex = ordered_unique_nonempty(bad_da_regex)
-
-    good_url_parts = ordered_unique_nonempty(good_url_parts)
-    bad_url_parts = ordered_unique_nonempty(bad_url_parts)
-    good_url_regex = ordered_unique_nonempty(good_url_regex)
-    bad_url_regex = ordered_unique_nonempty(bad_url_regex)
-
-# ordered uniqueness, https://stackoverflow.com/questions/12897374/get-unique-values-from-a-list-in-python
-ordered_unique_nonempty = lambda listable: fnt.reduce(lambda l, x: l.append(x) or l if x not in l and bool(x) else l, listable, [])
+# Bloom filters of exact table keys, for the PAC's BloomKeys
+# bit positions are (h1 + i*h2) mod n_bits for i < n_hashes, from the 32 bit FNV-1a hash h1 of the key and its
+# xorshift h2, as in JS; FNV-1a hashes with different offsets are too correlated for h2
+# the bits are written in order as base64, 6 to a digit
+def bloom_hashes(key):
+    """The 32 bit FNV-1a hash of a key's characters, and its xorshift."""
+    h1 = 2166136261
+    for c in key:
+        h1 = ((h1 ^ ord(c))*16777619) & 0xffffffff
+    h2 = h1 ^ ((h1 << 13) & 0xffffffff)
+    h2 ^= h2 >> 17
+    h2 ^= (h2 << 5) & 0xffffffff
+    return h1, h2
+
+def bloom_filter(keys, false_positive_rate):
+    """A Bloom filter of keys with about the given false positive rate: (base64 bits, n_bits, n_hashes).
+n_bits is rounded up to a multiple of 24, so the base64 has no padding."""
+    n_bits = 24*int(np.ceil(-len(keys)*np.log(false_positive_rate)/np.log(2)**2/24.))
+    n_hashes = max(1, int(round(n_bits/len(keys)*np.log(2))))
+    bits = np.zeros(n_bits, dtype=bool)
+    for key in keys:
+        (h1, h2) = bloom_hashes(key)
+        bits[(h1 + h2*np.arange(n_hashes, dtype=np.int64)) % n_bits] = True
+    return base64.b64encode(np.packbits(bits).tobytes()).decode('ascii'), n_bits, n_hashes
+
+# keyword-based matching of url_parts rules, after Adblock Plus
+# https://adblockplus.org/blog/investigating-filter-matching-algorithms
+# a url's keywords are its runs of 3 or more [a-z0-9%]; a rule's candidates are such runs bounded by other characters
+# except '*', so each is a keyword of every url the rule matches
+url_keywords_re = re.compile(r'[a-z0-9%]{3,}')
+keyword_candidate_re = re.compile(r'[^a-z0-9%*]([a-z0-9%]{3,})(?=[^a-z0-9%*])')
+
+def rule_keyword(rule, buckets):
+    """The keyword of a url_parts rule: the candidate with the fewest rules in buckets so far, then the longest,
+or '' if the rule has no candidates."""
+    return min(keyword_candidate_re.findall(rule.lower()), key=lambda keyword: (len(buckets.get(keyword, ())), -len(keyword)),
+               default='')
+
+# host buckets of domain anchored regex rules
+# a rule's literal host, followed by '/', a separator or an end anchor, is a domain suffix of every host it matches,
+# so the rule is in the bucket of the last two labels of its host, or of its one label
+host_literal_re = re.compile(r'^(?:\|\|)?((?:[\w-]+\.)*[\w-]+)[/^|]')
+
+def rule_host_key(rule):
+    """The host bucket of a domain anchored rule, or '' if its host has a wildcard or may continue past the rule."""
+    match = host_literal_re.match(rule)
+    return '.'.join(match.group(1).lower().split('.')[-2:]) if match else ''
+
+def host_keys(host):
+    """The host buckets that the PAC tests for a host: its last two labels and its last label."""
+    labels = host.split('.')
+    return ['.'.join(labels[-2:]), labels[-1]]
+
+# prefix-factored regex assembly, after Perl's Regexp::Assemble
+# atoms: an escape, character class or other character, with any quantifier, or a wildcard's tempered token
+regex_char_re = r'\\.|\[\^?\]?(?:\\.|[^\]\\])*\]|[^\\[()|]'
+regex_atom_re = re.compile(r'\(\?:\(\?!(?:' + regex_char_re + r')+\)\[\\s\\S\]\)\*|(?:' + regex_char_re +
+                           r')(?:(?:[?*+]|\{\d+(?:,\d*)?\})\??)?')
+regex_group_re = re.compile(r'(?<!\\)(?:\\\\)*[()|]|\\\d')
+
+def regex_assemble(patterns):
+    """Assemble regex's into one alternation with shared prefixes factored out, e.g. ab|ac|ad -> a[bcd].
+
+Patterns without groups (other than tempered tokens), alternation or backreferences are merged into a trie of their atoms. Because the PAC only
+tests whether a regex matches, a pattern that extends another one is dropped: wherever it matches, so does the
+shorter one. Sibling single characters become a character class. Other patterns, such as wildcards with their
+numbered lookahead groups, follow unchanged and in order, which keeps their group numbers."""
+    trie = {}
+    others = []
+    for pattern in patterns:
+        atoms = regex_atom_re.findall(pattern)
+        if ''.join(atoms) != pattern or any(regex_group_re.search(atom) for atom in atoms if not atom.startswith('(?:(?!')):
+            others.append(pattern)
+            continue
+        node = trie
+        for atom in atoms:
+            if None in node: break  # a prefix of this pattern is already a pattern
+            node = node.setdefault(atom, {})
+        else:
+            # mark the end with None, replacing any longer patterns
+            node.clear()
+            node[None] = None
+    def emit(root):
+        # post-order walk with an explicit stack, so patterns deeper than the recursion limit still assemble
+        emitted = {}
+        stack = [(root, False)]
+        while stack:
+            (node, children_done) = stack.pop()
+            if None in node:
+                emitted[id(node)] = ''
+            elif not children_done:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.values())
+            else:
+                alternatives = []
+                chars = []
+                for (atom, child) in node.items():
+                    if None in child and (len(atom) == 1 and atom not in '^$.]-/' or len(atom) == 2 and atom[0] == '\\' and not atom[1].isalnum()):
+                        chars.append(atom)
+                    else:
+                        alternatives.append(atom + emitted.pop(id(child)))
+                if chars: alternatives.append(chars[0] if len(chars) == 1 else '[' + ''.join(chars) + ']')
+                emitted[id(node)] = alternatives[0] if len(alternatives) == 1 else '(?:' + '|'.join(alternatives) + ')'
+        return emitted[id(root)]
+    return '|'.join(([emit(trie)] if trie else []) + others)
+
+js_regex_token_re = re.compile(r'\\(\d+)|\\.|\[\^?\]?(?:\\.|[^\]\\])*\]|(\()(?!\?)|[\s\S]')
+
+def js_regex_to_python(regex):
+    """Name a JS regex's numbered groups for Python, whose re module reads backreferences above \\99 as octal escapes."""
+    n_group = 0
+    tokens = []
+    for match in js_regex_token_re.finditer(regex):
+        if match.group(1):
+            tokens.append('(?P=g{})'.format(match.group(1)))
+        elif match.group(2):
+            n_group += 1
+            tokens.append('(?P<g{:d}>'.format(n_group))
+        else:
+            tokens.append(match.group())
+    return ''.join(tokens)
 
 # list variables based on EasyList strategies above
 # initial values prepended before EasyList rules
 # pass updates and services from these domains
 # handle organization-specific ad and tracking servers in later commit
 # https://support.apple.com/en-us/HT210060
-good_da_host_exact = ['apple.com',
-                      'albert.apple.com',
-                      'captive.apple.com',
-                      'gs.apple.com',
-                      'humb.apple.com',
-                      'static.ips.apple.com',
-                      'tbsc.apple.com',
-                      'time-ios.apple.com',
-                      'time.apple.com',
-                      'time-macos.apple.com',
-                      'gdmf.apple.com',
-                      'deviceenrollment.apple.com',
-                      'deviceservices-external.apple.com',
-                      'identity.apple.com',
-                      'iprofiles.apple.com',
-                      'mdmenrollment.apple.com',
-                      'setup.icloud.com',
-                      'appldnld.apple.com',
-                      'gg.apple.com',
-                      'gnf-mdn.apple.com',
-                      'gnf-mr.apple.com',
-                      'gs.apple.com',
-                      'ig.apple.com',
-                      'mesu.apple.com',
-                      'oscdn.apple.com',
-                      'osrecovery.apple.com',
-                      'skl.apple.com',
-                      'swcdn.apple.com',
-                      'swdist.apple.com',
-                      'swdownload.apple.com',
-                      'swpost.apple.com',
-                      'swscan.apple.com',
-                      'updates-http.cdn-apple.com',
-                      'updates.cdn-apple.com',
-                      'xp.apple.com',
-                      'ppq.apple.com',
-                      'lcdn-registration.apple.com',
-                      'crl.apple.com',
-                      'crl.entrust.net',
-                      'crl3.digicert.com',
-                      'crl4.digicert.com',
-                      'ocsp.apple.com',
-                      'ocsp.digicert.com',
-                      'ocsp.entrust.net',
-                      'ocsp.verisign.net',
-                      'icloud.com',
-                      'apple-dns.net',
-                      'swcdn.apple.com',
-                      'init.itunes.apple.com',  # use nslookup to determine canonical names
-                      'init-cdn.itunes-apple.com.akadns.net',
-                      'itunes.apple.com.edgekey.net',
-                      'setup.icloud.com',
-                      'p32-escrowproxy.icloud.com',
-                      'p32-escrowproxy.fe.apple-dns.net',
-                      'keyvalueservice.icloud.com',
-                      'keyvalueservice.fe.apple-dns.net',
-                      'p32-bookmarks.icloud.com',
-                      'p32-bookmarks.fe.apple-dns.net',
-                      'p32-ckdatabase.icloud.com',
-                      'p32-ckdatabase.fe.apple-dns.net',
-                      'configuration.apple.com',
-                      'configuration.apple.com.edgekey.net',
-                      'mesu.apple.com',
-                      'mesu-cdn.apple.com.akadns.net',
-                      'mesu.g.aaplimg.com',
-                      'gspe1-ssl.ls.apple.com',
-                      'gspe1-ssl.ls.apple.com.edgekey.net',
-                      'api-glb-bos.smoot.apple.com',
-                      'query.ess.apple.com',
-                      'query-geo.ess-apple.com.akadns.net',
-                      'query.ess-apple.com.akadns.net',
-                      'setup.fe.apple-dns.net',
-                      'gsa.apple.com',
-                      'gsa.apple.com.akadns.net',
-                      'icloud-content.com',
-                      'usbos-edge.icloud-content.com',
-                      'usbos.ce.apple-dns.net',
-                      'lcdn-locator.apple.com',
-                      'lcdn-locator.apple.com.akadns.net',
-                      'lcdn-locator-usuqo.apple.com.akadns.net',
-                      'cl1.apple.com',
-                      'cl2.apple.com',
-                      'cl3.apple.com',
-                      'cl4.apple.com',
-                      'cl5.apple.com',
-                      'cl1-cdn.origin-apple.com.akadns.net',
-                      'cl2-cdn.origin-apple.com.akadns.net',
-                      'cl3-cdn.origin-apple.com.akadns.net',
-                      'cl4-cdn.origin-apple.com.akadns.net',
-                      'cl5-cdn.origin-apple.com.akadns.net',
-                      'cl1.apple.com.edgekey.net',
-                      'cl2.apple.com.edgekey.net',
-                      'cl3.apple.com.edgekey.net',
-                      'cl4.apple.com.edgekey.net',
-                      'cl5.apple.com.edgekey.net',
-                      'xp.apple.com',
-                      'xp.itunes-apple.com.akadns.net',
-                      'mt-ingestion-service-pv.itunes.apple.com',
-                      'p32-sharedstreams.icloud.com',
-                      'p32-sharedstreams.fe.apple-dns.net',
-                      'p32-fmip.icloud.com',
-                      'p32-fmip.fe.apple-dns.net',
-                      'gsp-ssl.ls.apple.com',
-                      'gsp-ssl.ls-apple.com.akadns.net',
-                      'gsp-ssl.ls2-apple.com.akadns.net',
-                      'gspe35-ssl.ls.apple.com',
-                      'gspe35-ssl.ls-apple.com.akadns.net',
-                      'gspe35-ssl.ls.apple.com.edgekey.net',
-                      'gsp64-ssl.ls.apple.com',
-                      'gsp64-ssl.ls-apple.com.akadns.net',
-                      'mt-ingestion-service-st11.itunes.apple.com',
-                      'mt-ingestion-service-st11.itunes-apple.com.akadns.net',
-                      'microsoft.com', 'mozilla.com', 'mozilla.org']
-good_da_host_regex = ['||push.apple.com^',
-                      '||itunes.apple.com^',
-                      '||apps.apple.com^',
-                      '||mzstatic.com^']
-good_da_hostpath_exact = []
-good_da_hostpath_regex = []
-good_da_regex = []
-bad_da_host_exact = []
-bad_da_host_regex = []
-bad_da_hostpath_exact = []
-bad_da_hostpath_regex = []
-bad_da_regex = []
-good_url_parts = []
-bad_url_parts = []
-good_url_regex = []
-bad_url_regex = []
+good_da_host_exact = OrderedRuleSet(['apple.com',
+                                     'albert.apple.com',
+                                     'captive.apple.com',
+                                     'gs.apple.com',
+                                     'humb.apple.com',
+                                     'static.ips.apple.com',
+                                     'tbsc.apple.com',
+                                     'time-ios.apple.com',
+                                     'time.apple.com',
+                                     'time-macos.apple.com',
+                                     'gdmf.apple.com',
+                                     'deviceenrollment.apple.com',
+                                     'deviceservices-external.apple.com',
+                                     'identity.apple.com',
+                                     'iprofiles.apple.com',
+                                     'mdmenrollment.apple.com',
+                                     'setup.icloud.com',
+                                     'appldnld.apple.com',
+                                     'gg.apple.com',
+                                     'gnf-mdn.apple.com',
+                                     'gnf-mr.apple.com',
+                                     'gs.apple.com',
+                                     'ig.apple.com',
+                                     'mesu.apple.com',
+                                     'oscdn.apple.com',
+                                     'osrecovery.apple.com',
+                                     'skl.apple.com',
+                                     'swcdn.apple.com',
+                                     'swdist.apple.com',
+                                     'swdownload.apple.com',
+                                     'swpost.apple.com',
+                                     'swscan.apple.com',
+                                     'updates-http.cdn-apple.com',
+                                     'updates.cdn-apple.com',
+                                     'xp.apple.com',
+                                     'ppq.apple.com',
+                                     'lcdn-registration.apple.com',
+                                     'crl.apple.com',
+                                     'crl.entrust.net',
+                                     'crl3.digicert.com',
+                                     'crl4.digicert.com',
+                                     'ocsp.apple.com',
+                                     'ocsp.digicert.com',
+                                     'ocsp.entrust.net',
+                                     'ocsp.verisign.net',
+                                     'icloud.com',
+                                     'apple-dns.net',
+                                     'swcdn.apple.com',
+                                     'init.itunes.apple.com',  # use nslookup to determine canonical names
+                                     'init-cdn.itunes-apple.com.akadns.net',
+                                     'itunes.apple.com.edgekey.net',
+                                     'setup.icloud.com',
+                                     'p32-escrowproxy.icloud.com',
+                                     'p32-escrowproxy.fe.apple-dns.net',
+                                     'keyvalueservice.icloud.com',
+                                     'keyvalueservice.fe.apple-dns.net',
+                                     'p32-bookmarks.icloud.com',
+                                     'p32-bookmarks.fe.apple-dns.net',
+                                     'p32-ckdatabase.icloud.com',
+                                     'p32-ckdatabase.fe.apple-dns.net',
+                                     'configuration.apple.com',
+                                     'configuration.apple.com.edgekey.net',
+                                     'mesu.apple.com',
+                                     'mesu-cdn.apple.com.akadns.net',
+                                     'mesu.g.aaplimg.com',
+                                     'gspe1-ssl.ls.apple.com',
+                                     'gspe1-ssl.ls.apple.com.edgekey.net',
+                                     'api-glb-bos.smoot.apple.com',
+                                     'query.ess.apple.com',
+                                     'query-geo.ess-apple.com.akadns.net',
+                                     'query.ess-apple.com.akadns.net',
+                                     'setup.fe.apple-dns.net',
+                                     'gsa.apple.com',
+                                     'gsa.apple.com.akadns.net',
+                                     'icloud-content.com',
+                                     'usbos-edge.icloud-content.com',
+                                     'usbos.ce.apple-dns.net',
+                                     'lcdn-locator.apple.com',
+                                     'lcdn-locator.apple.com.akadns.net',
+                                     'lcdn-locator-usuqo.apple.com.akadns.net',
+                                     'cl1.apple.com',
+                                     'cl2.apple.com',
+                                     'cl3.apple.com',
+                                     'cl4.apple.com',
+                                     'cl5.apple.com',
+                                     'cl1-cdn.origin-apple.com.akadns.net',
+                                     'cl2-cdn.origin-apple.com.akadns.net',
+                                     'cl3-cdn.origin-apple.com.akadns.net',
+                                     'cl4-cdn.origin-apple.com.akadns.net',
+                                     'cl5-cdn.origin-apple.com.akadns.net',
+                                     'cl1.apple.com.edgekey.net',
+                                     'cl2.apple.com.edgekey.net',
+                                     'cl3.apple.com.edgekey.net',
+                                     'cl4.apple.com.edgekey.net',
+                                     'cl5.apple.com.edgekey.net',
+                                     'xp.apple.com',
+                                     'xp.itunes-apple.com.akadns.net',
+                                     'mt-ingestion-service-pv.itunes.apple.com',
+                                     'p32-sharedstreams.icloud.com',
+                                     'p32-sharedstreams.fe.apple-dns.net',
+                                     'p32-fmip.icloud.com',
+                                     'p32-fmip.fe.apple-dns.net',
+                                     'gsp-ssl.ls.apple.com',
+                                     'gsp-ssl.ls-apple.com.akadns.net',
+                                     'gsp-ssl.ls2-apple.com.akadns.net',
+                                     'gspe35-ssl.ls.apple.com',
+                                     'gspe35-ssl.ls-apple.com.akadns.net',
+                                     'gspe35-ssl.ls.apple.com.edgekey.net',
+                                     'gsp64-ssl.ls.apple.com',
+                                     'gsp64-ssl.ls-apple.com.akadns.net',
+                                     'mt-ingestion-service-st11.itunes.apple.com',
+                                     'mt-ingestion-service-st11.itunes-apple.com.akadns.net',
+                                     'microsoft.com', 'mozilla.com', 'mozilla.org'])
+good_da_host_regex = OrderedRuleSet(['||push.apple.com^',
+                                     '||itunes.apple.com^',
+                                     '||apps.apple.com^',
+                                     '||mzstatic.com^'])
+good_da_hostpath_exact = OrderedRuleSet()
+good_da_hostpath_regex = OrderedRuleSet()
+good_da_regex = OrderedRuleSet()
+bad_da_host_exact = OrderedRuleSet()
+bad_da_host_regex = OrderedRuleSet()
+bad_da_hostpath_exact = OrderedRuleSet()
+bad_da_hostpath_regex = OrderedRuleSet()
+bad_da_regex = OrderedRuleSet()
+good_url_parts = OrderedRuleSet()
+bad_url_parts = OrderedRuleSet()
+good_url_regex = OrderedRuleSet()
+bad_url_regex = OrderedRuleSet()
 
 # provide explicit expceptions to good hosts or domains, e.g. iad.apple.com
-good_da_host_exceptions_exact = [ 'iad.apple.com',
-                                  'iadsdk.apple.com',
-                                  'iadsdk.apple.com.edgekey.net',
-                                  'bingads.microsoft.com',
-                                  'azure.bingads.trafficmanager.net',
-                                  'choice.microsoft.com',
-                                  'choice.microsoft.com.nsatc.net',
-                                  'corpext.msitadfs.glbdns2.microsoft.com',
-                                  'corp.sts.microsoft.com',
-                                  'df.telemetry.microsoft.com',
-                                  'diagnostics.support.microsoft.com',
-                                  'feedback.search.microsoft.com',
-                                  'i1.services.social.microsoft.com',
-                                  'i1.services.social.microsoft.com.nsatc.net',
-                                  'redir.metaservices.microsoft.com',
-                                  'reports.wes.df.telemetry.microsoft.com',
-                                  'services.wes.df.telemetry.microsoft.com',
-                                  'settings-sandbox.data.microsoft.com',
-                                  'settings-win.data.microsoft.com',
-                                  'sqm.df.telemetry.microsoft.com',
-                                  'sqm.telemetry.microsoft.com',
-                                  'sqm.telemetry.microsoft.com.nsatc.net',
-                                  'statsfe1.ws.microsoft.com',
-                                  'statsfe2.update.microsoft.com.akadns.net',
-                                  'statsfe2.ws.microsoft.com',
-                                  'survey.watson.microsoft.com',
-                                  'telecommand.telemetry.microsoft.com',
-                                  'telecommand.telemetry.microsoft.com.nsatc.net',
-                                  'telemetry.urs.microsoft.com',
-                                  'vortex.data.microsoft.com',
-                                  'vortex-sandbox.data.microsoft.com',
-                                  'vortex-win.data.microsoft.com',
-                                  'cy2.vortex.data.microsoft.com.akadns.net',
-                                  'watson.microsoft.com',
-                                  'watson.ppe.telemetry.microsoft.com'
-                                  'watson.telemetry.microsoft.com',
-                                  'watson.telemetry.microsoft.com.nsatc.net',
-                                  'wes.df.telemetry.microsoft.com',
-                                  'win10.ipv6.microsoft.com',
-                                  'www.bingads.microsoft.com',
-                                  'survey.watson.microsoft.com' ]
+good_da_host_exceptions_exact = OrderedRuleSet([ 'iad.apple.com',
+                                                 'iadsdk.apple.com',
+                                                 'iadsdk.apple.com.edgekey.net',
+                                                 'bingads.microsoft.com',
+                                                 'azure.bingads.trafficmanager.net',
+                                                 'choice.microsoft.com',
+                                                 'choice.microsoft.com.nsatc.net',
+                                                 'corpext.msitadfs.glbdns2.microsoft.com',
+                                                 'corp.sts.microsoft.com',
+                                                 'df.telemetry.microsoft.com',
+                                                 'diagnostics.support.microsoft.com',
+                                                 'feedback.search.microsoft.com',
+                                                 'i1.services.social.microsoft.com',
+                                                 'i1.services.social.microsoft.com.nsatc.net',
+                                                 'redir.metaservices.microsoft.com',
+                                                 'reports.wes.df.telemetry.microsoft.com',
+                                                 'services.wes.df.telemetry.microsoft.com',
+                                                 'settings-sandbox.data.microsoft.com',
+                                                 'settings-win.data.microsoft.com',
+                                                 'sqm.df.telemetry.microsoft.com',
+                                                 'sqm.telemetry.microsoft.com',
+                                                 'sqm.telemetry.microsoft.com.nsatc.net',
+                                                 'statsfe1.ws.microsoft.com',
+                                                 'statsfe2.update.microsoft.com.akadns.net',
+                                                 'statsfe2.ws.microsoft.com',
+                                                 'survey.watson.microsoft.com',
+                                                 'telecommand.telemetry.microsoft.com',
+                                                 'telecommand.telemetry.microsoft.com.nsatc.net',
+                                                 'telemetry.urs.microsoft.com',
+                                                 'vortex.data.microsoft.com',
+                                                 'vortex-sandbox.data.microsoft.com',
+                                                 'vortex-win.data.microsoft.com',
+                                                 'cy2.vortex.data.microsoft.com.akadns.net',
+                                                 'watson.microsoft.com',
+                                                 'watson.ppe.telemetry.microsoft.com'
+                                                 'watson.telemetry.microsoft.com',
+                                                 'watson.telemetry.microsoft.com.nsatc.net',
+                                                 'wes.df.telemetry.microsoft.com',
+                                                 'win10.ipv6.microsoft.com',
+                                                 'www.bingads.microsoft.com',
+                                                 'survey.watson.microsoft.com' ])
 
 # Long regex filter """here""" documents
 
@@ -1865,7 +2920,9 @@ partner
 sponsor
 affiliate"""
 
-high_weight_regex = [re.compile(x,re.IGNORECASE) for x in high_weight_regex_strings.split('\n') if not bool(re.search(r'^\s*?(?:#|$)',x))]
+# patterns only; high_weight_regex_counts matches them case-insensitively
+high_weight_regex = [x for x in high_weight_regex_strings.split('\n') if not bool(re.search(r'^\s*?(?:#|$)',x))]
+high_weight_regex_grams = ['regex: ' + pattern for pattern in high_weight_regex]
 
 # regex to limit regex filters (bootstrapping in part from securemecca.com PAC regex keywords)
 if False:
@@ -2268,9 +3325,22 @@ acuityplatform\\.com
 header\\.direct'''
 
 badregex_regex_filters = '\n'.join(x for x in badregex_regex_filters.split('\n') if not bool(re.search(r'^\s*?(?:#|$)',x)))
-badregex_regex_filters_re = re.compile(r'(?:{})'.format('|'.join(badregex_regex_filters.split('\n'))),re.IGNORECASE)
+badregex_regex_filters_re = r'(?:{})'.format('|'.join(badregex_regex_filters.split('\n')))
+
+# the large regex's are compiled when first used
+@fnt.lru_cache(maxsize=None)
+def badregex_filters_index():
+    """Split badregex_regex_filters into an index of its literal filters, e.g. bluekai\\.com, and a regex of the rest."""
+    literal_filter_re = re.compile(r'(?:[^\\.^$*+?()\[\]{}|]|\\[^A-Za-z0-9])+')
+    filters = badregex_regex_filters.split('\n')
+    literals = [re.sub(r'\\(.)', r'\1', x).lower() for x in filters if literal_filter_re.fullmatch(x)]
+    remainder = [x for x in filters if not literal_filter_re.fullmatch(x)]
+    return LiteralIndex(literals), re.compile(r'(?:{})'.format('|'.join(remainder)) if remainder else r'(?!)', re.IGNORECASE)
+
+@fnt.lru_cache(maxsize=None)
+def commentname_sections_ignore_reprog():
+    return re.compile(commentname_sections_ignore_re)
 
 if __name__ == "__main__":
     res = EasyListPAC()
-
-sys.exit()
+    sys.exit()